@@ -130,9 +130,25 @@ def solve_pair(OD_pair):
     result["gcd"] = agents
     return result
 
+def analytical_pair(pair):
+    '''
+    Analytically solve a single OD pair.
+    
+    Parameters:
+        pair (OD_pair): The OD pair to solve.
+        
+    Returns:
+        dict: The lengths of the cycle in the naive and gcd solutions and the inequity of the optimal cycle.
+    '''
+    if num_of_routes(pair.routes) < 2:
+        return {"origin": pair.origin, "destination": pair.destination, "naive": 0, "gcd": 0}
+    opt_cycle, avg_time = optimal_cycle_order(pair.routes)
+    inequity = find_inequity_of_cycle(pair.routes, opt_cycle, avg_time)
+    return {"origin": pair.origin, "destination": pair.destination, **solve_pair(pair), "inequity": inequity}
+
 def analytical_simulation(pairs):
     '''
-    Analytically solve the OD pairs.
+    Analytically solve the OD pairs (see parallel_od.analytical_pairs to solve them on several cores).
     
     Parameters:
         pairs (list of OD_pair): The OD pairs to solve.
@@ -140,16 +156,7 @@ def analytical_simulation(pairs):
     Returns:
         list: A list of dictionaries containing the lengths of cycles in the naive and gcd solutions.
     '''
-    res = []
-
-    for pair in pairs:
-        if num_of_routes(pair.routes) < 2:
-            res.append({"origin": pair.origin, "destination": pair.destination, "naive": 0, "gcd": 0})
-            continue
-        opt_cycle, avg_time = optimal_cycle_order(pair.routes)
-        inequity = find_inequity_of_cycle(pair.routes, opt_cycle, avg_time)
-        res.append({"origin": pair.origin, "destination": pair.destination, **solve_pair(pair), "inequity": inequity})
-    return res
+    return [analytical_pair(pair) for pair in pairs]
 
 def cycle_test():
     # raw_route_data = [(14, 55.0), (3, 57.0), (4, 56)]
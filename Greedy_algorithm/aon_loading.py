@@ -0,0 +1,134 @@
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from array_network import attach_image
+
+
+def _origin_trees(arrays, cost: np.ndarray, origins: list, ods: dict, fullTrees: bool, method: str, batchSize: int):
+    """
+    Yields the labels and predecessor links of the shortest path tree of every origin (position in arrays.origins)
+    """
+    shortestPaths = arrays.shortestPaths
+    origin_nodes = arrays.origins.tolist()
+    od_dest = arrays.od_dest.tolist()
+    if method == "heap":
+        costList = np.asarray(cost).tolist()
+        for k in origins:
+            shortestPaths.run(origin_nodes[k], costList, targets=None if fullTrees else [od_dest[od] for od in ods[k]])
+            yield shortestPaths.label, shortestPaths.pred
+    elif method == "csgraph":
+        for start in range(0, len(origins), batchSize):
+            labels, preds = shortestPaths.batch([origin_nodes[k] for k in origins[start:start + batchSize]], cost)
+            for label, pred in zip(labels, preds):
+                yield label.tolist(), pred.tolist()
+    else:
+        raise ValueError(f'Shortest path method must be "heap" or "csgraph", got {method}')
+
+
+def load_origins(arrays, cost: np.ndarray, origins, computeXbar: bool = True, collectTrees: bool = False,
+                 method: str = "heap", batchSize: int = 256):
+    """
+    All-or-nothing loading of the OD pairs of the given origins (positions in arrays.origins).
+    With method "heap" every origin is solved by the heap based Dijkstra of arrays.shortestPaths, stopping once all
+    the destinations of the origin are settled (unless the full trees are collected), with method "csgraph" the
+    origins are solved batchSize at a time by scipy.sparse.csgraph.dijkstra.
+
+    :return: SPTT, x_bar (link flows) and x_bar_od, either (od indices, link indices, flows) of the shortest paths
+             or, when collectTrees is True, the shortest path tree (predecessor link of every node) of every origin
+    """
+    od_dest = arrays.od_dest.tolist()
+    od_demand = arrays.od_demand.tolist()
+    origin_ptr = arrays.origin_ptr.tolist()
+    origin_ods = arrays.origin_ods.tolist()
+    origin_nodes = arrays.origins.tolist()
+    origins = list(origins)
+    # loaded ODs of every origin
+    ods = {k: [od for od in origin_ods[origin_ptr[k]:origin_ptr[k + 1]] if od_demand[od] > 0] for k in origins}
+    trees = []
+    x_bar_ods = []
+    x_bar_links = []
+    x_bar_flows = []
+    SPTT = 0.0
+    shortestPaths = arrays.shortestPaths
+    for k, (label, pred) in zip(origins, _origin_trees(arrays, cost, origins, ods, collectTrees, method, batchSize)):
+        r = origin_nodes[k]
+        if collectTrees:
+            trees.append(pred[:])
+        for od in ods[k]:
+            dem = od_demand[od]
+            s = od_dest[od]
+            SPTT = SPTT + label[s] * dem
+
+            if computeXbar and r != s:
+                spLinks = shortestPaths.path(s, pred)
+                x_bar_links.extend(spLinks)
+                x_bar_flows.extend([dem] * len(spLinks))
+                if not collectTrees:
+                    x_bar_ods.extend([od] * len(spLinks))
+    x_bar = np.bincount(x_bar_links, weights=x_bar_flows, minlength=arrays.numLinks).astype(np.float64)
+    if collectTrees:
+        x_bar_od = np.array(trees, dtype=np.int32).reshape(len(trees), arrays.numNodes)
+    else:
+        x_bar_od = (np.array(x_bar_ods, dtype=np.int64), np.array(x_bar_links, dtype=np.int64), np.array(x_bar_flows))
+    return SPTT, x_bar, x_bar_od
+
+
+# State of a pool worker: the array network and a read-only view of the shared link costs
+_worker = {}
+
+
+def _init_worker(arrays, costName: str):
+    if isinstance(arrays, str):
+        arrays = attach_image(arrays)
+    shm = SharedMemory(name=costName)
+    _worker["shm"] = shm
+    _worker["arrays"] = arrays
+    _worker["cost"] = np.ndarray((arrays.numLinks,), dtype=np.float64, buffer=shm.buf)
+
+
+def _load_chunk(task):
+    start, end, computeXbar, collectTrees, method = task
+    return load_origins(_worker["arrays"], _worker["cost"], range(start, end), computeXbar, collectTrees, method)
+
+
+class ParallelAON:
+    """
+    All-or-nothing loading with the origins split across a pool of worker processes.
+    The network is sent to the workers once (or attached from its image), the link costs are published at every loading through shared memory.
+    """
+
+    def __init__(self, arrays, workers: int, chunksPerWorker: int = 4):
+        self.arrays = arrays
+        self.workers = workers
+        self.shm = SharedMemory(create=True, size=max(arrays.numLinks, 1) * 8)
+        self.cost = np.ndarray((arrays.numLinks,), dtype=np.float64, buffer=self.shm.buf)
+        # the workers attach to the network image when there is one (see ArrayNetwork.save_image)
+        self.pool = Pool(workers, initializer=_init_worker,
+                         initargs=(arrays.imageFolder or arrays, self.shm.name))
+
+        bounds = np.linspace(0, len(arrays.origins), workers * chunksPerWorker + 1).astype(int).tolist()
+        self.chunks = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    def load(self, cost: np.ndarray, computeXbar: bool = True, collectTrees: bool = False, method: str = "heap"):
+        """
+        Same result as load_origins over all the origins
+        """
+        self.cost[:] = cost
+        tasks = [(start, end, computeXbar, collectTrees, method) for start, end in self.chunks]
+        results = self.pool.map(_load_chunk, tasks, chunksize=1)
+        SPTT = sum(result[0] for result in results)
+        x_bar = np.sum([result[1] for result in results], axis=0)
+        if collectTrees:
+            x_bar_od = np.concatenate([result[2] for result in results])
+        else:
+            x_bar_od = tuple(np.concatenate([result[2][i] for result in results]) for i in range(3))
+        return SPTT, x_bar, x_bar_od
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        del self.cost
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,253 @@
+import json
+import os
+
+import numpy as np
+
+from shortest_paths import ShortestPaths
+
+# arrays of a network image (see ArrayNetwork.save_image), shared read-only by the processes attached to it
+IMAGE_ARRAYS = ("init_node", "term_node", "max_capacity", "length", "fft", "alpha", "beta", "speedLimit", "toll",
+                "noise_flow", "out_links", "out_heads", "out_ptr",
+                "od_orig", "od_dest", "od_demand", "origins", "origin_ptr", "origin_ods")
+IMAGE_VERSION = 1
+
+
+class ArrayNetwork:
+    """
+    Compiled representation of a FlowTransportNetwork used by the assignment algorithms.
+    Nodes are mapped to integer ids, links are stored in contiguous arrays (same order as linkSet)
+    and the adjacency is kept in CSR forward star form.
+    """
+
+    def __init__(self,
+                 node_ids: list,
+                 init_node: np.ndarray,
+                 term_node: np.ndarray,
+                 capacity: np.ndarray,
+                 length: np.ndarray,
+                 fft: np.ndarray,
+                 alpha: np.ndarray,
+                 beta: np.ndarray,
+                 speedLimit: np.ndarray,
+                 toll: np.ndarray,
+                 noise_flow: np.ndarray = None
+                 ):
+        self.nodeIds = list(node_ids)  # node index -> node id (str)
+        self.nodeIndex = {n: i for i, n in enumerate(self.nodeIds)}  # node id (str) -> node index
+        self.numNodes = len(self.nodeIds)
+
+        self.init_node = np.ascontiguousarray(init_node, dtype=np.int32)
+        self.term_node = np.ascontiguousarray(term_node, dtype=np.int32)
+        self.numLinks = len(self.init_node)
+
+        self.max_capacity = np.ascontiguousarray(capacity, dtype=np.float64)
+        self.capacity = self.max_capacity.copy()
+        self.length = np.ascontiguousarray(length, dtype=np.float64)
+        self.fft = np.ascontiguousarray(fft, dtype=np.float64)
+        self.alpha = np.ascontiguousarray(alpha, dtype=np.float64)
+        self.beta = np.ascontiguousarray(beta, dtype=np.float64)
+        self.speedLimit = np.ascontiguousarray(speedLimit, dtype=np.float64)
+        self.toll = np.ascontiguousarray(toll, dtype=np.float64)
+        self.has_noise_flow = noise_flow is not None
+        self.noise_flow = np.zeros(self.numLinks) if noise_flow is None else np.ascontiguousarray(noise_flow, dtype=np.float64)
+
+        self.flow = np.zeros(self.numLinks)
+        self.cost = self.fft.copy()
+
+        # CSR forward star: the links leaving node i are out_links[out_ptr[i]:out_ptr[i + 1]]
+        self.out_links = np.argsort(self.init_node, kind="stable").astype(np.int32)
+        self.out_heads = self.term_node[self.out_links]
+        self.out_ptr = np.zeros(self.numNodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.init_node, minlength=self.numNodes), out=self.out_ptr[1:])
+
+        # Demand, filled by set_demand
+        self.odKeys = []
+        self.odIndex = {}
+        self.od_orig = np.zeros(0, dtype=np.int32)
+        self.od_dest = np.zeros(0, dtype=np.int32)
+        self.od_demand = np.zeros(0)
+        self.origins = np.zeros(0, dtype=np.int32)
+        self.origin_ptr = np.zeros(1, dtype=np.int64)
+        self.origin_ods = np.zeros(0, dtype=np.int32)
+
+        # Shortest path engine with the labels and preds of the last Dijkstra run (see shortest_paths.py)
+        self.shortestPaths = ShortestPaths(self.numNodes, self.init_node, self.term_node)
+
+        # Folder of the network image of these arrays (see save_image), pool workers attach to it instead of
+        # receiving a copy of the arrays
+        self.imageFolder = None
+
+    def set_demand(self, od_keys: list, demand: np.ndarray, origins: list = None):
+        """
+        Stores the OD pairs as index arrays. The ODs of each origin are kept contiguous in origin_ods,
+        the ODs of origin origins[k] are origin_ods[origin_ptr[k]:origin_ptr[k + 1]]
+        """
+        self.odKeys = list(od_keys)
+        self.odIndex = {od: i for i, od in enumerate(self.odKeys)}
+        # the demand no longer matches the network image
+        self.imageFolder = None
+        self.od_orig = np.array([self.nodeIndex[r] for r, _ in self.odKeys], dtype=np.int32)
+        self.od_dest = np.array([self.nodeIndex[s] for _, s in self.odKeys], dtype=np.int32)
+        self.od_demand = np.ascontiguousarray(demand, dtype=np.float64)
+
+        if origins is None:
+            origins = dict.fromkeys(r for r, _ in self.odKeys)
+        self.origins = np.array([self.nodeIndex[r] for r in origins], dtype=np.int32)
+
+        origin_pos = np.full(self.numNodes, len(self.origins), dtype=np.int64)
+        origin_pos[self.origins] = np.arange(len(self.origins))
+        od_pos = origin_pos[self.od_orig]
+        self.origin_ods = np.argsort(od_pos, kind="stable").astype(np.int32)
+        self.origin_ods = self.origin_ods[od_pos[self.origin_ods] < len(self.origins)]
+        self.origin_ptr = np.zeros(len(self.origins) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(od_pos, minlength=len(self.origins) + 1)[:len(self.origins)], out=self.origin_ptr[1:])
+
+    def save_image(self, folder: str):
+        """
+        Publishes the network (link arrays, forward star and demand) as a folder of .npy files that other processes
+        can attach to without copying (see attach_image). image.json is written last and marks the image complete.
+        The demand changed afterwards with set_demand is not part of the image
+        """
+        os.makedirs(folder, exist_ok=True)
+        for name in IMAGE_ARRAYS:
+            np.save(os.path.join(folder, name + ".npy"), getattr(self, name))
+        np.save(os.path.join(folder, "nodeIds.npy"), np.array(self.nodeIds, dtype=str))
+        with open(os.path.join(folder, "image.json"), "w") as f:
+            json.dump({"version": IMAGE_VERSION, "numNodes": self.numNodes, "numLinks": self.numLinks,
+                       "has_noise_flow": self.has_noise_flow}, f)
+        self.imageFolder = folder
+
+    def link_key(self, link: int):
+        return self.nodeIds[self.init_node[link]], self.nodeIds[self.term_node[link]]
+
+    def reset_flow(self):
+        self.flow[:] = 0.0
+        self.cost[:] = self.fft
+
+    def reset(self):
+        self.capacity[:] = self.max_capacity
+        self.reset_flow()
+
+
+def build_array_network(network) -> ArrayNetwork:
+    """
+    Compiles the dict based network (linkSet, nodeSet, tripSet) into an ArrayNetwork.
+    The link order of the arrays is the iteration order of network.linkSet
+    """
+    links = list(network.linkSet.values())
+    node_ids = list(network.nodeSet.keys())
+    node_index = {n: i for i, n in enumerate(node_ids)}
+
+    arrays = ArrayNetwork(node_ids=node_ids,
+                          init_node=[node_index[link.init_node] for link in links],
+                          term_node=[node_index[link.term_node] for link in links],
+                          capacity=[link.max_capacity for link in links],
+                          length=[link.length for link in links],
+                          fft=[link.fft for link in links],
+                          alpha=[link.alpha for link in links],
+                          beta=[link.beta for link in links],
+                          speedLimit=[link.speedLimit for link in links],
+                          toll=[link.toll for link in links],
+                          noise_flow=[link.noise_flow for link in links] if links and hasattr(links[0], "noise_flow") else None
+                          )
+    arrays.capacity[:] = [link.capacity for link in links]
+    arrays.flow[:] = [link.flow for link in links]
+    arrays.cost[:] = [link.cost for link in links]
+
+    # origins in the order of the trips, originZones is a set whose order changes between runs
+    origins = None
+    if network.originZones:
+        origins = [r for r in dict.fromkeys(r for r, _ in network.tripSet) if r in network.originZones]
+    arrays.set_demand(list(network.tripSet.keys()),
+                      [d.demand for d in network.tripSet.values()],
+                      origins=origins)
+    return arrays
+
+
+def build_array_network_from_frames(network_df, demand_df, noise_flow: bool = False):
+    """
+    Builds the ArrayNetwork straight from the processed network and demand frames (see network_import.import_network),
+    with the same node, link, OD and origin order as build_array_network on the network read from them.
+    Returns None when the frames hold the same link or OD pair twice, the dict based network then keeps the first
+    position of the pair with the values of its last row, use build_array_network on it instead.
+
+    :param noise_flow: also read the noise_flow column (zero where missing), as the network of assignment_singleOD does
+    """
+    init_ids = network_df["init_node"].to_numpy().astype(np.int64)
+    term_ids = network_df["term_node"].to_numpy().astype(np.int64)
+    orig_ids = demand_df["init_node"].to_numpy().astype(np.int64)
+    dest_ids = demand_df["term_node"].to_numpy().astype(np.int64)
+    base = int(max(init_ids.max(initial=0), term_ids.max(initial=0), orig_ids.max(initial=0),
+                   dest_ids.max(initial=0))) + 1
+    if len(np.unique(init_ids * base + term_ids)) < len(init_ids) or \
+            len(np.unique(orig_ids * base + dest_ids)) < len(orig_ids):
+        return None
+
+    # nodes in order of first appearance, init node before term node within a link
+    endpoints = np.empty(2 * len(init_ids), dtype=np.int64)
+    endpoints[0::2] = init_ids
+    endpoints[1::2] = term_ids
+    sorted_ids, first = np.unique(endpoints, return_index=True)
+    appearance = np.argsort(first)
+    node_ids = sorted_ids[appearance].astype(str).tolist()
+    node_of_sorted = np.empty(len(sorted_ids), dtype=np.int64)
+    node_of_sorted[appearance] = np.arange(len(sorted_ids))
+
+    def column(name: str) -> np.ndarray:
+        return network_df[name].to_numpy(dtype=np.float64)
+
+    noise = None
+    if noise_flow:
+        noise = column("noise_flow") if "noise_flow" in network_df else np.zeros(len(init_ids))
+    arrays = ArrayNetwork(node_ids=node_ids,
+                          init_node=node_of_sorted[np.searchsorted(sorted_ids, init_ids)],
+                          term_node=node_of_sorted[np.searchsorted(sorted_ids, term_ids)],
+                          capacity=column("capacity"),
+                          length=column("length"),
+                          fft=column("free_flow_time"),
+                          alpha=column("b"),
+                          beta=column("power"),
+                          speedLimit=column("speed"),
+                          toll=column("toll"),
+                          noise_flow=noise
+                          )
+
+    # origins in the order of the trips, as build_array_network does
+    _, first = np.unique(orig_ids, return_index=True)
+    arrays.set_demand(list(zip(orig_ids.astype(str).tolist(), dest_ids.astype(str).tolist())),
+                      demand_df["demand"].to_numpy(dtype=np.float64),
+                      origins=orig_ids[np.sort(first)].astype(str).tolist())
+    return arrays
+
+
+def attach_image(folder: str) -> ArrayNetwork:
+    """
+    ArrayNetwork on a network image published with ArrayNetwork.save_image. The shared arrays are memory mapped
+    read-only, so every process attached to the same image uses the same pages, only the state changed by the
+    assignment (capacity, noise flow, flow, cost) and the shortest path engine are allocated per process.
+    """
+    with open(os.path.join(folder, "image.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != IMAGE_VERSION:
+        raise ValueError(f"Network image version {meta['version']} in {folder}, expected {IMAGE_VERSION}")
+
+    arrays = ArrayNetwork.__new__(ArrayNetwork)
+    for name in IMAGE_ARRAYS:
+        setattr(arrays, name, np.load(os.path.join(folder, name + ".npy"), mmap_mode="r"))
+    arrays.nodeIds = np.load(os.path.join(folder, "nodeIds.npy")).tolist()
+    arrays.nodeIndex = {n: i for i, n in enumerate(arrays.nodeIds)}
+    arrays.numNodes = meta["numNodes"]
+    arrays.numLinks = meta["numLinks"]
+    arrays.has_noise_flow = meta["has_noise_flow"]
+
+    arrays.capacity = np.array(arrays.max_capacity)
+    arrays.noise_flow = np.array(arrays.noise_flow)
+    arrays.flow = np.zeros(arrays.numLinks)
+    arrays.cost = np.array(arrays.fft)
+
+    nodeIds = arrays.nodeIds
+    arrays.odKeys = [(nodeIds[r], nodeIds[s]) for r, s in zip(arrays.od_orig.tolist(), arrays.od_dest.tolist())]
+    arrays.odIndex = {od: i for i, od in enumerate(arrays.odKeys)}
+    arrays.shortestPaths = ShortestPaths(arrays.numNodes, arrays.init_node, arrays.term_node)
+    arrays.imageFolder = folder
+    return arrays
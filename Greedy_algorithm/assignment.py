@@ -1,19 +1,27 @@
-import heapq
 import math
 import time
 
 import networkx as nx
-import scipy
 import matplotlib.pyplot as plt
 
 from network_import import *
+from array_network import build_array_network, build_array_network_from_frames, attach_image
+from od_flows import create_od_flows
+from od_results import ODResults
+from aon_loading import load_origins, ParallelAON
+from line_search import line_search
+from conjugate_directions import target_weights
+from path_assignment import PathFlows
+from bush_assignment import BushFlows
+from warm_start import initial_link_flows, initial_od_flows, default_od_flows_file, single_od_flows
+from cost_kernels import vectorized, link_costs, bpr_costs, bpr_derivatives, constant_costs, constant_derivatives, \
+    greenshields_costs, greenshields_derivatives
 from utils import PathUtils
 
 
 class FlowTransportNetwork:
 
     def __init__(self):
-        self.linkSetWithOD = {}
         self.linkSet = {}
         self.nodeSet = {}
 
@@ -22,19 +30,49 @@ class FlowTransportNetwork:
         self.originZones = {}
 
         self.networkx_graph = None
+        self.arrays = None
+        self.odFlows = None  # link flows of every OD pair, see od_flows.py
+        self.aonEngine = None  # ParallelAON used by loadAON when the assignment runs on several processes
+        self.shortestPathMethod = "heap"  # "heap" or "csgraph", see aon_loading.load_origins
+        self.paths = None  # path sets of the path based assignment (algorithm="GP"), see path_assignment.py
+        self.bushes = None  # bushes of the origin based assignment (algorithm="B"), see bush_assignment.py
 
     def to_networkx(self):
         if self.networkx_graph is None:
             self.networkx_graph = nx.DiGraph([(int(begin),int(end)) for (begin,end) in self.linkSet.keys()])
         return self.networkx_graph
 
+    def compile(self):
+        """
+        Builds (once) the array representation used by the assignment algorithms
+        """
+        if self.arrays is None:
+            self.arrays = build_array_network(self)
+        return self.arrays
+
+    def store_flows(self):
+        """
+        Copies the flows and costs computed on the arrays back to the link objects
+        """
+        for link, flow, cost in zip(self.linkSet.values(), self.arrays.flow.tolist(), self.arrays.cost.tolist()):
+            link.flow = flow
+            link.cost = cost
+
     def reset_flow(self):
         for link in self.linkSet.values():
             link.reset_flow()
+        if self.arrays is not None:
+            self.arrays.reset_flow()
+        if self.odFlows is not None:
+            self.odFlows.reset()
 
     def reset(self):
         for link in self.linkSet.values():
             link.reset()
+        if self.arrays is not None:
+            self.arrays.reset()
+        if self.odFlows is not None:
+            self.odFlows.reset()
 
 
 class Zone:
@@ -60,10 +98,6 @@ class Node:
         self.outLinks = []  # list of node ids (strs)
         self.inLinks = []  # list of node ids (strs)
 
-        # For Dijkstra
-        self.label = np.inf
-        self.pred = None
-
 
 class Link:
     """
@@ -126,32 +160,18 @@ class Demand:
         self.demand = float(demand)
 
 
-def DijkstraHeap(origin, network: FlowTransportNetwork):
+def DijkstraHeap(origin, network: FlowTransportNetwork, cost: list = None, targets: list = None):
     """
     Calcualtes shortest path from an origin to all other destinations.
-    The labels and preds are stored in node instances.
+    The origin is a node index of the network arrays, the labels and preds (link indices) are stored in
+    network.arrays.shortestPaths (see shortest_paths.py), with targets the search stops once they are all settled.
     """
-    for n in network.nodeSet:
-        network.nodeSet[n].label = np.inf
-        network.nodeSet[n].pred = None
-    network.nodeSet[origin].label = 0.0
-    network.nodeSet[origin].pred = None
-    SE = [(0, origin)]
-    while SE:
-        currentNode = heapq.heappop(SE)[1]
-        currentLabel = network.nodeSet[currentNode].label
-        for toNode in network.nodeSet[currentNode].outLinks:
-            link = (currentNode, toNode)
-            newNode = toNode
-            newPred = currentNode
-            existingLabel = network.nodeSet[newNode].label
-            newLabel = currentLabel + network.linkSet[link].cost
-            if newLabel < existingLabel:
-                heapq.heappush(SE, (newLabel, newNode))
-                network.nodeSet[newNode].label = newLabel
-                network.nodeSet[newNode].pred = newPred
+    if cost is None:
+        cost = network.arrays.cost.tolist()
+    network.arrays.shortestPaths.run(origin, cost, targets=targets)
 
 
+@vectorized(bpr_costs, bpr_derivatives)
 def BPRcostFunction(optimal: bool,
                     fft: float,
                     alpha: float,
@@ -168,6 +188,7 @@ def BPRcostFunction(optimal: bool,
     return fft * (1 + alpha * math.pow((flow * 1.0 / capacity), beta))
 
 
+@vectorized(constant_costs, constant_derivatives)
 def constantCostFunction(optimal: bool,
                          fft: float,
                          alpha: float,
@@ -182,6 +203,7 @@ def constantCostFunction(optimal: bool,
     return fft
 
 
+@vectorized(greenshields_costs, greenshields_derivatives)
 def greenshieldsCostFunction(optimal: bool,
                              fft: float,
                              alpha: float,
@@ -202,131 +224,75 @@ def updateTravelTime(network: FlowTransportNetwork, optimal: bool = False, costF
     """
     This method updates the travel time on the links with the current flow
     """
-    for l in network.linkSet:
-        network.linkSet[l].cost = costFunction(optimal,
-                                               network.linkSet[l].fft,
-                                               network.linkSet[l].alpha,
-                                               network.linkSet[l].flow,
-                                               network.linkSet[l].capacity,
-                                               network.linkSet[l].beta,
-                                               network.linkSet[l].length,
-                                               network.linkSet[l].speedLimit
-                                               )
-
-
-def findAlpha(x_bar, network: FlowTransportNetwork, optimal: bool = False, costFunction=BPRcostFunction):
+    arrays = network.arrays
+    arrays.cost[:] = link_costs(arrays, optimal, costFunction)
+
+
+def findAlpha(x_bar, network: FlowTransportNetwork, optimal: bool = False, costFunction=BPRcostFunction,
+              tolerance: float = 1e-8):
     """
-    This uses unconstrained optimization to calculate the optimal step size required
-    for Frank-Wolfe Algorithm
+    This uses a line search on the derivative of the objective function to calculate the optimal step size required
+    for Frank-Wolfe Algorithm (see line_search.py)
     """
-
-    def df(alpha):
-        assert 0 <= alpha <= 1
-        sum_derivative = 0  # this line is the derivative of the objective function.
-        for l in network.linkSet:
-            tmpFlow = alpha * x_bar[l] + (1 - alpha) * network.linkSet[l].flow
-            tmpCost = costFunction(optimal,
-                                   network.linkSet[l].fft,
-                                   network.linkSet[l].alpha,
-                                   tmpFlow,
-                                   network.linkSet[l].capacity,
-                                   network.linkSet[l].beta,
-                                   network.linkSet[l].length,
-                                   network.linkSet[l].speedLimit
-                                   )
-            sum_derivative = sum_derivative + (x_bar[l] - network.linkSet[l].flow) * tmpCost
-        return sum_derivative
-
-    sol = scipy.optimize.root_scalar(df, x0=np.array([0.5]), bracket=(0, 1))
-    assert 0 <= sol.root <= 1
-    return sol.root
+    arrays = network.arrays
+    alpha = line_search(arrays, arrays.flow, x_bar - arrays.flow, optimal, costFunction, tolerance=tolerance)
+    assert 0 <= alpha <= 1
+    return alpha
 
 
 def tracePreds(dest, network: FlowTransportNetwork):
     """
-    This method traverses predecessor nodes in order to create a shortest path
+    This method traverses predecessor links in order to create a shortest path (list of link indices)
     """
-    prevNode = network.nodeSet[dest].pred
-    spLinks = []
-    while prevNode is not None:
-        spLinks.append((prevNode, dest))
-        dest = prevNode
-        prevNode = network.nodeSet[dest].pred
-    return spLinks
+    return network.arrays.shortestPaths.path(dest)
 
 
 def loadAON(network: FlowTransportNetwork, computeXbar: bool = True):
     """
     This method produces auxiliary flows for all or nothing loading.
+    x_bar is the array of link flows, x_bar_od holds the auxiliary flows of the OD pairs in the form expected by
+    network.odFlows: (od indices, link indices, flows) or the shortest path tree of every origin
     """
-    x_bar = {l: 0.0 for l in network.linkSet}
-    x_bar_od = {l: 0.0 for l in network.linkSetWithOD}
-    SPTT = 0.0
-    for r in network.originZones:
-        DijkstraHeap(r, network=network)
-        for s in network.zoneSet[r].destList:
-            dem = network.tripSet[r, s].demand
-
-            if dem <= 0:
-                continue
-
-            SPTT = SPTT + network.nodeSet[s].label * dem
-
-            if computeXbar and r != s:
-                for spLink in tracePreds(s, network):
-                    x_bar[spLink] = x_bar[spLink] + dem
-                    x_bar_od[spLink + (r, s)] = dem
-    return SPTT, x_bar, x_bar_od
+    arrays = network.arrays
+    collectTrees = computeXbar and network.odFlows is not None and network.odFlows.collects_trees
+    if network.aonEngine is not None:
+        return network.aonEngine.load(arrays.cost, computeXbar=computeXbar, collectTrees=collectTrees,
+                                      method=network.shortestPathMethod)
+    return load_origins(arrays, arrays.cost, range(len(arrays.origins)),
+                        computeXbar=computeXbar, collectTrees=collectTrees, method=network.shortestPathMethod)
 
 
 def readDemand(demand_df: pd.DataFrame, network: FlowTransportNetwork):
-    for index, row in demand_df.iterrows():
-
-        init_node = str(int(row["init_node"]))
-        term_node = str(int(row["term_node"]))
-        demand = row["demand"]
-
+    init_nodes = demand_df["init_node"].to_numpy().astype(np.int64).astype(str).tolist()
+    term_nodes = demand_df["term_node"].to_numpy().astype(np.int64).astype(str).tolist()
+    odKeys = list(zip(init_nodes, term_nodes))
+    # the destinations of the pairs already in tripSet are already in destList
+    newPairs = [odKey for odKey in dict.fromkeys(odKeys) if odKey not in network.tripSet]
+    for (init_node, term_node), demand in zip(odKeys, demand_df["demand"].tolist()):
         network.tripSet[init_node, term_node] = Demand(init_node, term_node, demand)
-        if init_node not in network.zoneSet:
-            network.zoneSet[init_node] = Zone(init_node)
-        if term_node not in network.zoneSet:
-            network.zoneSet[term_node] = Zone(term_node)
-        if term_node not in network.zoneSet[init_node].destList:
-            network.zoneSet[init_node].destList.append(term_node)
-
-    for link in network.linkSet:
-        for od in network.tripSet:
-            # print(link, od)
-            # print(network.linkSet[link])
-            network.linkSetWithOD[link + od] = Link(init_node=network.linkSet[link].init_node,
-                                                        term_node=network.linkSet[link].term_node,
-                                                        capacity=network.linkSet[link].capacity,
-                                                        length=network.linkSet[link].length,
-                                                        fft=network.linkSet[link].fft,
-                                                        b=network.linkSet[link].alpha,
-                                                        power=network.linkSet[link].beta,
-                                                        speed_limit=network.linkSet[link].speedLimit,
-                                                        toll=network.linkSet[link].toll,
-                                                        linkType=network.linkSet[link].linkType
-                                                        )
+    # zones in order of first appearance, the origin before the destination of a pair
+    zones = [None] * (2 * len(odKeys))
+    zones[0::2] = init_nodes
+    zones[1::2] = term_nodes
+    for zone in dict.fromkeys(zones):
+        if zone not in network.zoneSet:
+            network.zoneSet[zone] = Zone(zone)
+    for init_node, term_node in newPairs:
+        network.zoneSet[init_node].destList.append(term_node)
+
     print(len(network.tripSet), "OD pairs")
     print(len(network.zoneSet), "OD zones")
 
 
 def readNetwork(network_df: pd.DataFrame, network: FlowTransportNetwork):
-    for index, row in network_df.iterrows():
-
-        init_node = str(int(row["init_node"]))
-        term_node = str(int(row["term_node"]))
-        capacity = row["capacity"]
-        length = row["length"]
-        free_flow_time = row["free_flow_time"]
-        b = row["b"]
-        power = row["power"]
-        speed = row["speed"]
-        toll = row["toll"]
-        link_type = row["link_type"]
-
+    init_nodes = network_df["init_node"].to_numpy().astype(np.int64).astype(str).tolist()
+    term_nodes = network_df["term_node"].to_numpy().astype(np.int64).astype(str).tolist()
+    columns = zip(init_nodes, term_nodes, network_df["capacity"].tolist(), network_df["length"].tolist(),
+                  network_df["free_flow_time"].tolist(), network_df["b"].tolist(), network_df["power"].tolist(),
+                  network_df["speed"].tolist(), network_df["toll"].tolist(), network_df["link_type"].tolist())
+    for init_node, term_node, capacity, length, free_flow_time, b, power, speed, toll, link_type in columns:
+        # a link already in linkSet already has its nodes in outLinks and inLinks
+        newLink = (init_node, term_node) not in network.linkSet
         network.linkSet[init_node, term_node] = Link(init_node=init_node,
                                                      term_node=term_node,
                                                      capacity=capacity,
@@ -342,9 +308,8 @@ def readNetwork(network_df: pd.DataFrame, network: FlowTransportNetwork):
             network.nodeSet[init_node] = Node(init_node)
         if term_node not in network.nodeSet:
             network.nodeSet[term_node] = Node(term_node)
-        if term_node not in network.nodeSet[init_node].outLinks:
+        if newLink:
             network.nodeSet[init_node].outLinks.append(term_node)
-        if init_node not in network.nodeSet[term_node].inLinks:
             network.nodeSet[term_node].inLinks.append(init_node)
 
     print(len(network.nodeSet), "nodes")
@@ -352,24 +317,9 @@ def readNetwork(network_df: pd.DataFrame, network: FlowTransportNetwork):
 
 
 def get_TSTT(network: FlowTransportNetwork, costFunction=BPRcostFunction, use_max_capacity: bool = True):
-    TSTT = round(sum([network.linkSet[a].flow * costFunction(optimal=False,
-                                                             fft=network.linkSet[
-                                                                 a].fft,
-                                                             alpha=network.linkSet[
-                                                                 a].alpha,
-                                                             flow=network.linkSet[
-                                                                 a].flow,
-                                                             capacity=network.linkSet[
-                                                                 a].max_capacity if use_max_capacity else network.linkSet[
-                                                                 a].capacity,
-                                                             beta=network.linkSet[
-                                                                 a].beta,
-                                                             length=network.linkSet[
-                                                                 a].length,
-                                                             maxSpeed=network.linkSet[
-                                                                 a].speedLimit
-                                                             ) for a in
-                      network.linkSet]), 9)
+    arrays = network.compile()
+    capacity = arrays.max_capacity if use_max_capacity else arrays.capacity
+    TSTT = round(float(np.dot(arrays.flow, link_costs(arrays, False, costFunction, capacity=capacity))), 9)
     return TSTT
 
 
@@ -380,94 +330,210 @@ def assignment_loop(network: FlowTransportNetwork,
                     accuracy: float = 0.001,
                     maxIter: int = 1000,
                     maxTime: int = 60,
-                    verbose: bool = True):
+                    verbose: bool = True,
+                    lineSearchTolerance: float = 1e-8,
+                    odFlowMode: str = "link",
+                    workers: int = 1,
+                    shortestPathMethod: str = "heap",
+                    initialFlow=None,
+                    initialODFlows=None):
     """
     For explaination of the algorithm see Chapter 7 of:
     https://sboyles.github.io/blubook.html
     PDF:
     https://sboyles.github.io/teaching/ce392c/book.pdf
+
+    CFW and BFW are the conjugate and bi-conjugate Frank-Wolfe algorithms (see conjugate_directions.py):
+    the target point of the line search combines the all-or-nothing loading with the previous target points.
+
+    GP is the path based gradient projection algorithm (see path_assignment.py), it keeps the path set of every OD pair
+    (see getRoutes). B is the origin based Algorithm B (see bush_assignment.py). Both track the OD link flows in the
+    "link" mode, filled once the assignment stops.
+
+    With workers > 1 the all-or-nothing loadings are split by origin across a pool of processes (see aon_loading.py)
+
+    With initialFlow the assignment is warm started from the given link flows instead of an all-or-nothing loading
+    (see warm_start.py), initialODFlows gives the link flows of the OD pairs at that point. Without them the OD pairs
+    file written next to the initialFlow result file is used if there is one; otherwise FW, CFW, BFW and MSA start the
+    OD flows from the all-or-nothing loading at the initial costs (an approximation fading with the iterations),
+    while GP and B need them.
     """
+    arrays = network.compile()
+    network.shortestPathMethod = shortestPathMethod
+
+    initialLinkFlows = None
+    initialODLinkFlows = None
+    if initialFlow is not None:
+        initialLinkFlows = initial_link_flows(arrays, initialFlow)
+        if initialODFlows is None:
+            initialODFlows = default_od_flows_file(initialFlow)
+        if initialODFlows is not None:
+            initialODLinkFlows = initial_od_flows(arrays, initialODFlows)
+        else:
+            initialODLinkFlows = single_od_flows(arrays, initialLinkFlows)
+        if initialODLinkFlows is not None:
+            # the OD flows of the warm start can only be kept as a sparse OD x link matrix
+            odFlowMode = "link"
+
+    network.odFlows = create_od_flows("link" if algorithm in ("GP", "B") else odFlowMode, arrays)
     network.reset_flow()
+    network.paths = PathFlows(arrays, systemOptimal, costFunction) if algorithm == "GP" else None
+    network.bushes = BushFlows(arrays, systemOptimal, costFunction) if algorithm == "B" else None
+
+    if initialLinkFlows is not None:
+        solver = network.paths if network.paths is not None else network.bushes
+        if solver is not None:
+            if initialODLinkFlows is None:
+                raise ValueError("The warm start of GP and B needs the link flows of the OD pairs (initialODFlows)")
+            solver.load(initialODLinkFlows)
+        else:
+            arrays.flow[:] = initialLinkFlows
+            if initialODLinkFlows is None:
+                if verbose:
+                    print("No OD link flows for the warm start, "
+                          "the OD flows start from the all-or-nothing loading at the initial costs")
+                updateTravelTime(network=network, optimal=systemOptimal, costFunction=costFunction)
+                _, _, initialODLinkFlows = loadAON(network=network)
+            network.odFlows.step(1.0, network.odFlows.aon(initialODLinkFlows))
+        updateTravelTime(network=network, optimal=systemOptimal, costFunction=costFunction)
+    warmStart = initialLinkFlows is not None
 
     iteration_number = 1
     gap = np.inf
     TSTT = np.inf
     assignmentStartTime = time.time()
-
-    # Check if desired accuracy is reached
-    while gap > accuracy:
-
-        # Get x_bar throug all-or-nothing assignment
-        _, x_bar, x_bar_od = loadAON(network=network)
-
-        if algorithm == "MSA" or iteration_number == 1:
-            alpha = (1 / iteration_number)
-        elif algorithm == "FW":
-            # If using Frank-Wolfe determine the step size alpha by solving a nonlinear equation
-            alpha = findAlpha(x_bar,
-                              network=network,
-                              optimal=systemOptimal,
-                              costFunction=costFunction)
+    targets = []  # previous target points (link flows, OD flows), most recent first, used by CFW and BFW
+    previousStep = 1.0
+
+    if workers > 1:
+        network.aonEngine = ParallelAON(arrays, workers)
+
+    try:
+        # Check if desired accuracy is reached
+        while gap > accuracy:
+
+            if algorithm == "GP":
+                # Path based iteration, the link flows and costs are updated along the way
+                network.paths.sweep()
+            elif algorithm == "B":
+                # Origin based iteration, the link flows and costs are updated along the way
+                network.bushes.sweep()
+            else:
+                # Get x_bar throug all-or-nothing assignment
+                _, x_bar, x_bar_od = loadAON(network=network)
+                x_bar_od = network.odFlows.aon(x_bar_od)
+                target, target_od = x_bar, x_bar_od
+
+                if algorithm == "MSA" or (iteration_number == 1 and not warmStart):
+                    # the warm start counts as the first iterate
+                    alpha = (1 / (iteration_number + warmStart))
+                elif algorithm in ("FW", "CFW", "BFW"):
+                    # Target point of the line search, the all-or-nothing loading for FW
+                    weights = target_weights(algorithm, arrays, systemOptimal, costFunction, x_bar,
+                                             [t for t, _ in targets], previousStep)
+                    if len(weights) > 1:
+                        target = np.sum([w * t for w, t in zip(weights, [x_bar] + [t for t, _ in targets])], axis=0)
+                        target_od = network.odFlows.combine(weights, [x_bar_od] + [t for _, t in targets])
+
+                    # Determine the step size alpha by solving a nonlinear equation
+                    alpha = findAlpha(target,
+                                      network=network,
+                                      optimal=systemOptimal,
+                                      costFunction=costFunction,
+                                      tolerance=lineSearchTolerance)
+                    if alpha == 0 and target is not x_bar:
+                        # The conjugate direction is not a descent direction, restart from the Frank-Wolfe direction
+                        target, target_od = x_bar, x_bar_od
+                        targets = []
+                        alpha = findAlpha(target,
+                                          network=network,
+                                          optimal=systemOptimal,
+                                          costFunction=costFunction,
+                                          tolerance=lineSearchTolerance)
+                else:
+                    print("Terminating the program.....")
+                    print("The solution algorithm ", algorithm, " does not exist!")
+                    raise TypeError('Algorithm must be MSA, FW, CFW, BFW, GP or B')
+
+                # Apply flow improvement
+                arrays.flow[:] = alpha * target + (1 - alpha) * arrays.flow
+                network.odFlows.step(alpha, target_od)
+                targets = [(target, target_od)] + targets[:1]
+                previousStep = alpha
+            # Compute the new travel time
+            updateTravelTime(network=network,
+                             optimal=systemOptimal,
+                             costFunction=costFunction)
+
+            # Compute the relative gap
+            SPTT, _, _ = loadAON(network=network, computeXbar=False)
+            SPTT = round(SPTT, 9)
+            TSTT = round(float(np.dot(arrays.flow, arrays.cost)), 9)
+
+            # print(TSTT, SPTT, "TSTT, SPTT, Max capacity", max([l.capacity for l in network.linkSet.values()]))
+            gap = (TSTT / SPTT) - 1
+            if gap < 0:
+                print("Error, gap is less than 0, this should not happen")
+                print("TSTT", "SPTT", TSTT, SPTT)
+
+                # Uncomment for debug
+
+                # print("Capacities:", [l.capacity for l in network.linkSet.values()])
+                # print("Flows:", [l.flow for l in network.linkSet.values()])
+
+            # Compute the real total travel time (which in the case of system optimal rounting is different from the TSTT above)
+            TSTT = get_TSTT(network=network, costFunction=costFunction)
+
+            iteration_number += 1
+            if iteration_number > maxIter:
+                if verbose:
+                    print(
+                        "The assignment did not converge to the desired gap and the max number of iterations has been reached")
+                    print("Assignment took", round(time.time() - assignmentStartTime, 5), "seconds")
+                    print("Current gap:", round(gap, 5))
+                break
+            if time.time() - assignmentStartTime > maxTime:
+                if verbose:
+                    print("The assignment did not converge to the desired gap and the max time limit has been reached")
+                    print("Assignment did ", iteration_number, "iterations")
+                    print("Current gap:", round(gap, 5))
+                break
         else:
-            print("Terminating the program.....")
-            print("The solution algorithm ", algorithm, " does not exist!")
-            raise TypeError('Algorithm must be MSA or FW')
-
-        # Apply flow improvement
-        for l in network.linkSet:
-            network.linkSet[l].flow = alpha * x_bar[l] + (1 - alpha) * network.linkSet[l].flow
-            for od in network.tripSet:
-                network.linkSetWithOD[l + od].flow = alpha * x_bar_od[l + od] + (1 - alpha) * network.linkSetWithOD[l + od].flow
-        # Compute the new travel time
-        updateTravelTime(network=network,
-                         optimal=systemOptimal,
-                         costFunction=costFunction)
-
-        # Compute the relative gap
-        SPTT, _, _ = loadAON(network=network, computeXbar=False)
-        SPTT = round(SPTT, 9)
-        TSTT = round(sum([network.linkSet[a].flow * network.linkSet[a].cost for a in
-                          network.linkSet]), 9)
-
-        # print(TSTT, SPTT, "TSTT, SPTT, Max capacity", max([l.capacity for l in network.linkSet.values()]))
-        gap = (TSTT / SPTT) - 1
-        if gap < 0:
-            print("Error, gap is less than 0, this should not happen")
-            print("TSTT", "SPTT", TSTT, SPTT)
-
-            # Uncomment for debug
-
-            # print("Capacities:", [l.capacity for l in network.linkSet.values()])
-            # print("Flows:", [l.flow for l in network.linkSet.values()])
-
-        # Compute the real total travel time (which in the case of system optimal rounting is different from the TSTT above)
-        TSTT = get_TSTT(network=network, costFunction=costFunction)
-
-        iteration_number += 1
-        if iteration_number > maxIter:
             if verbose:
-                print(
-                    "The assignment did not converge to the desired gap and the max number of iterations has been reached")
+                print("Assignment converged in ", iteration_number, "iterations")
                 print("Assignment took", round(time.time() - assignmentStartTime, 5), "seconds")
                 print("Current gap:", round(gap, 5))
-            return TSTT
-        if time.time() - assignmentStartTime > maxTime:
-            if verbose:
-                print("The assignment did not converge to the desired gap and the max time limit has been reached")
-                print("Assignment did ", iteration_number, "iterations")
-                print("Current gap:", round(gap, 5))
-            return TSTT
+    finally:
+        if network.aonEngine is not None:
+            network.aonEngine.close()
+            network.aonEngine = None
+
+    for solver in (network.paths, network.bushes):
+        if solver is not None:
+            network.odFlows.step(1.0, network.odFlows.aon(solver.od_link_flows()))
+    network.store_flows()
+    return TSTT
 
-    if verbose:
-        print("Assignment converged in ", iteration_number, "iterations")
-        print("Assignment took", round(time.time() - assignmentStartTime, 5), "seconds")
-        print("Current gap:", round(gap, 5))
 
-    return TSTT
+def getRoutes(network: FlowTransportNetwork, minFlow: float = 0.0) -> list:
+    """
+    Returns the routes found by the path based assignment (algorithm="GP") as a list of OD_pair objects,
+    the routes of every pair are sorted by travel time and ready for greedy.prep_data and analytical.optimal_cycle_order
+    """
+    if network.paths is None:
+        raise ValueError('Routes are only available after a path based assignment (algorithm="GP")')
+    return network.paths.routes(minFlow)
 
 
 def writeResults(network: FlowTransportNetwork, output_file: str, costFunction=BPRcostFunction,
-                 systemOptimal: bool = False, verbose: bool = True, graph: bool = False):
+                 systemOptimal: bool = False, verbose: bool = True, graph: bool = False, odPairs: list = None,
+                 odFormat: str = "txt", compressed: bool = False):
+    """
+    Writes the link flows to output_file and the link flows of the OD pairs to output_file with the suffix "_OD_pairs".
+    odPairs restricts the second file to the given (origin, destination) pairs, by default all the OD pairs are written.
+    With odFormat="npz" the second file is the columnar binary file of od_results.ODResults (_OD_pairs.npz),
+    compressed gzips the text file (_OD_pairs.txt.gz) or compresses the npz file
+    """
     outFile = open(output_file, "w")
     TSTT = get_TSTT(network=network, costFunction=costFunction)
     if verbose:
@@ -495,42 +561,25 @@ def writeResults(network: FlowTransportNetwork, output_file: str, costFunction=B
         outFile.write(tmpOut + "\n")
         
     outFile.close()
-    output_file = output_file.replace(".txt", "_OD_pairs.txt")
-    
-    
-    outFile = open(output_file,"w")
-    
-    outFile.write("OD PAIRS\n")
-    
-    outFile.write("init_node\tterm_node\tdemand\n")
-    outFile.write("init_node\tterm_node\tflow\ttravelTimeOnLink\n")
-    
-    for od in network.tripSet:
-        tmpOut = str(od[0]) + "\t" + str(od[1]) + "\t" + str(network.tripSet[od].demand)
-        outFile.write(tmpOut + "\n")
-        for i in network.linkSet:
-            if(network.linkSetWithOD[i + od].flow == 0.0):
-                continue
-            tmpOut = str(network.linkSet[i].init_node) + "\t" + str(
-                network.linkSet[i].term_node) + "\t" + str(
-                network.linkSetWithOD[i + od].flow) + "\t" + str(costFunction(False,
-                                                                   network.linkSet[i].fft,
-                                                                   network.linkSet[i].alpha,
-                                                                   network.linkSet[i].flow,
-                                                                   network.linkSet[i].max_capacity,
-                                                                   network.linkSet[i].beta,
-                                                                   network.linkSet[i].length,
-                                                                   network.linkSet[i].speedLimit
-                                                                   ))
-            outFile.write(tmpOut + "\n")
-        outFile.write("\n")
-    
+    if odFormat not in ("txt", "npz"):
+        raise ValueError(f'OD pairs format must be "txt" or "npz", got {odFormat}')
+    odResults = ODResults.from_network(network, costFunction, odPairs)
+    if odFormat == "npz":
+        odResults.save(output_file.replace(".txt", "_OD_pairs.npz"), compressed=compressed)
+    else:
+        odResults.write_text(output_file.replace(".txt", "_OD_pairs.txt" + (".gz" if compressed else "")),
+                             compressed=compressed)
+
     if graph:
         # for each OD pair draw a graph with weights as a flow
-        for od in network.tripSet:
+        linkKeys = list(network.linkSet)
+        for od in range(len(network.tripSet)):
             G = network.to_networkx()
-            for i in network.linkSet:
-                G.add_edge(network.linkSet[i].init_node, network.linkSet[i].term_node, weight=round(network.linkSetWithOD[i + od].flow,2))
+            odFlow = np.zeros(len(linkKeys))
+            odLinks, odFlows = network.odFlows.od_flows(od)
+            odFlow[odLinks] = odFlows
+            for l, i in enumerate(linkKeys):
+                G.add_edge(network.linkSet[i].init_node, network.linkSet[i].term_node, weight=round(odFlow[l],2))
             edge_labels = nx.get_edge_attributes(G, 'weight')
             # filter out the edges with 0 flow
             edge_labels = {k: v for k, v in edge_labels.items() if v > 0}
@@ -566,6 +615,8 @@ def load_network(net_file: str,
     readDemand(demand_df, network=network)
 
     network.originZones = set([k[0] for k in network.tripSet])
+    # the arrays are built from the columns directly, unless the frames repeat a link or an OD pair
+    network.arrays = build_array_network_from_frames(net_df, demand_df)
 
     if verbose:
         print("Network", net_name, "loaded")
@@ -574,9 +625,21 @@ def load_network(net_file: str,
     return network
 
 
+def attach_network(image_folder: str) -> FlowTransportNetwork:
+    """
+    Network on the arrays of a network image published with network.compile().save_image(image_folder),
+    shared read-only with all the other processes attached to it (see array_network.attach_image).
+    Only the arrays are attached, linkSet, nodeSet and tripSet stay empty: the network is meant for assignment_loop,
+    whose results are then in network.arrays and network.odFlows (writeResults needs a loaded network)
+    """
+    network = FlowTransportNetwork()
+    network.arrays = attach_image(image_folder)
+    return network
+
+
 def computeAssignment(net_file: str,
                       demand_file: str = None,
-                      algorithm: str = "FW",  # FW or MSA
+                      algorithm: str = "FW",  # FW, CFW, BFW, GP, B or MSA
                       costFunction=BPRcostFunction,
                       systemOptimal: bool = False,
                       accuracy: float = 0.0001,
@@ -584,8 +647,15 @@ def computeAssignment(net_file: str,
                       maxTime: int = 60,
                       results_file: str = None,
                       force_net_reprocess: bool = False,
-                      verbose: bool = True
-                      ) -> float:
+                      verbose: bool = True,
+                      lineSearchTolerance: float = 1e-8,
+                      odFlowMode: str = "link",
+                      workers: int = 1,
+                      shortestPathMethod: str = "heap",
+                      returnRoutes: bool = False,
+                      initialFlow=None,
+                      initialODFlows=None
+                      ):
     """
     This is the main function to compute the user equilibrium UE (default) or system optimal (SO) traffic assignment
     All the networks present on https://github.com/bstabler/TransportationNetworks following the tntp format can be loaded
@@ -596,6 +666,9 @@ def computeAssignment(net_file: str,
     :param algorithm:
            - "FW": Frank-Wolfe algorithm (see https://en.wikipedia.org/wiki/Frank%E2%80%93Wolfe_algorithm)
            - "MSA": Method of successive averages
+           - "CFW": Conjugate Frank-Wolfe, "BFW": Bi-conjugate Frank-Wolfe (see Mitradjieva, M., and Lindberg, P. O. "The stiff is moving—conjugate direction Frank-Wolfe methods with applications to traffic assignment." Transportation Science 47.2 (2013))
+           - "GP": Path based gradient projection (see Jayakrishnan, R., et al. "A faster path-based algorithm for traffic assignment." Transportation Research Record 1443 (1994)), the routes of the OD pairs are available with returnRoutes
+           - "B": Origin based Algorithm B (see Dial, R. B. "A path-based user equilibrium traffic assignment algorithm that obviates path storage and enumeration." Transportation Research Part B 40.10 (2006)), for high precision UE and SO
            For more information on how the algorithms work see https://sboyles.github.io/teaching/ce392c/book.pdf
     :param costFunction: Which cost function to use to compute travel time on edges, currently available functions are:
            - BPRcostFunction (see https://rdrr.io/rforge/travelr/man/bpr.function.html)
@@ -609,7 +682,20 @@ def computeAssignment(net_file: str,
            by default the result file is saved with the same name as the input network with the suffix "_flow.tntp" in the same folder
     :param force_net_reprocess: True if the network files should be reprocessed from the tntp sources
     :param verbose: print useful info in standard output
-    :return: Totoal system travel time
+    :param lineSearchTolerance: Precision of the Frank-Wolfe step size (see line_search.py)
+    :param odFlowMode: How the link flows of every OD pair are tracked (see od_flows.py):
+           - "link": sparse OD x link flow matrix updated at every iteration
+           - "origin": one shortest path tree per origin and iteration, OD link flows are reconstructed when written
+    :param workers: Number of processes computing the all-or-nothing loadings, 1 to run them in this process
+    :param shortestPathMethod: How the shortest paths of the all-or-nothing loadings are computed (see shortest_paths.py):
+           - "heap": heap based Dijkstra per origin, stopping once all its destinations are reached
+           - "csgraph": scipy.sparse.csgraph.dijkstra on batches of origins
+    :param returnRoutes: Also return the routes of the OD pairs (list of OD_pair, see getRoutes), requires algorithm "GP"
+    :param initialFlow: Link flows to warm start the assignment from: a results file written by writeResults or a flow.tntp file,
+           a dictionary (init_node, term_node) -> flow or an array in the link order of the network (see warm_start.py)
+    :param initialODFlows: Link flows of the OD pairs at initialFlow: an OD pairs file written by writeResults or a dictionary
+           (origin, destination) -> {(init_node, term_node): flow}, by default the OD pairs file next to the initialFlow results file
+    :return: Totoal system travel time, and the list of OD_pair objects when returnRoutes is True
     """
 
     network = load_network(net_file=net_file, demand_file=demand_file, verbose=verbose, force_net_reprocess=force_net_reprocess)
@@ -617,7 +703,10 @@ def computeAssignment(net_file: str,
     if verbose:
         print("Computing assignment...")
     TSTT = assignment_loop(network=network, algorithm=algorithm, systemOptimal=systemOptimal, costFunction=costFunction,
-                           accuracy=accuracy, maxIter=maxIter, maxTime=maxTime, verbose=verbose)
+                           accuracy=accuracy, maxIter=maxIter, maxTime=maxTime, verbose=verbose,
+                           lineSearchTolerance=lineSearchTolerance, odFlowMode=odFlowMode,
+                           workers=workers, shortestPathMethod=shortestPathMethod,
+                           initialFlow=initialFlow, initialODFlows=initialODFlows)
 
     if results_file is None:
         results_file = '_'.join(net_file.split("_")[:-1] + ["flow.tntp"])
@@ -629,6 +718,8 @@ def computeAssignment(net_file: str,
                  verbose=verbose,
                  graph=False)
 
+    if returnRoutes:
+        return TSTT, getRoutes(network)
     return TSTT
 
 
@@ -0,0 +1,309 @@
+import numpy as np
+
+from cost_kernels import link_cost_derivatives, refresh_links
+
+
+class BushFlows:
+    """
+    Origin based assignment with Algorithm B (Dial, 2006).
+    Every origin keeps a bush, an acyclic set of links reaching all the nodes, together with the flow it sends on
+    each of them. A sweep visits the origins one by one:
+        - links without flow that are not on the shortest path tree are dropped from the bush and links shortening
+          the longest bush paths are added (which keeps the bush acyclic)
+        - at every node, in reverse topological order, flow is shifted from the longest used bush path to the
+          shortest bush path, between the node and the last node the two paths share, by a Newton step
+    The costs of the links are updated after every shift.
+    """
+
+    def __init__(self, arrays, optimal: bool, costFunction, passes: int = 3, flowTolerance: float = 1e-12):
+        self.arrays = arrays
+        self.optimal = optimal
+        self.costFunction = costFunction
+        self.passes = passes  # equilibration passes per bush and sweep
+        self.flowTolerance = flowTolerance  # bush flows below this are considered unused
+        self.link_tail = arrays.init_node.tolist()
+        self.link_head = arrays.term_node.tolist()
+        self.in_links = [[] for _ in range(arrays.numNodes)]  # node index -> [(link index, tail node index), ...]
+        for link, (tail, head) in enumerate(zip(self.link_tail, self.link_head)):
+            self.in_links[head].append((link, tail))
+
+        od_dest = arrays.od_dest.tolist()
+        od_demand = arrays.od_demand.tolist()
+        origin_ptr = arrays.origin_ptr.tolist()
+        origin_ods = arrays.origin_ods.tolist()
+        self.origins = arrays.origins.tolist()
+        # origin position -> loaded OD indices
+        self.ods = [[od for od in origin_ods[origin_ptr[k]:origin_ptr[k + 1]] if od_demand[od] > 0 and od_dest[od] != r]
+                    for k, r in enumerate(self.origins)]
+        self.bushes = [None] * len(self.origins)  # origin position -> {link index: flow of the origin} of the bush links
+        self.orders = [None] * len(self.origins)  # origin position -> topological order of the bush nodes
+        self.derivative = np.zeros(arrays.numLinks)
+
+    def _refresh(self, links: list):
+        refresh_links(self.arrays, np.array(links, dtype=np.int64), self.optimal, self.costFunction, self.derivative)
+
+    def _topological_order(self, k: int) -> list:
+        bush = self.bushes[k]
+        indegree = [0] * self.arrays.numNodes
+        out_links = {}
+        for link in bush:
+            indegree[self.link_head[link]] += 1
+            out_links.setdefault(self.link_tail[link], []).append(link)
+        order = [self.origins[k]]
+        i = 0
+        while i < len(order):
+            for link in out_links.get(order[i], ()):
+                head = self.link_head[link]
+                indegree[head] -= 1
+                if indegree[head] == 0:
+                    order.append(head)
+            i += 1
+        return order
+
+    def _labels(self, k: int, cost: list, maximum: bool, usedOnly: bool):
+        """
+        Shortest (or longest) bush path labels and predecessor links, the longest paths can be restricted to used links
+        """
+        bush = self.bushes[k]
+        tolerance = self.flowTolerance
+        label = [-np.inf if maximum else np.inf] * self.arrays.numNodes
+        pred = [-1] * self.arrays.numNodes
+        order = self.orders[k]
+        label[order[0]] = 0.0
+        for node in order[1:]:
+            best = label[node]
+            for link, tail in self.in_links[node]:
+                flow = bush.get(link)
+                if flow is None or (usedOnly and flow <= tolerance):
+                    continue
+                newLabel = label[tail] + cost[link]
+                if (newLabel > best) if maximum else (newLabel < best):
+                    best = newLabel
+                    pred[node] = link
+            label[node] = best
+        return label, pred
+
+    def _initialize(self, k: int):
+        """
+        Initial bush: the links going away from the origin in terms of shortest path distance and the shortest path tree,
+        the demand of the origin is loaded on the shortest path tree
+        """
+        arrays = self.arrays
+        shortestPaths = arrays.shortestPaths
+        shortestPaths.run(self.origins[k], arrays.cost.tolist())
+        label = shortestPaths.label
+        bush = {}
+        for link, (tail, head) in enumerate(zip(self.link_tail, self.link_head)):
+            if label[tail] < label[head] < np.inf:
+                bush[link] = 0.0
+        for link in shortestPaths.pred:
+            if link != -1:
+                bush[link] = 0.0
+
+        loaded = set()
+        for od in self.ods[k]:
+            demand = float(arrays.od_demand[od])
+            path = shortestPaths.path(int(arrays.od_dest[od]))
+            for link in path:
+                bush[link] += demand
+            arrays.flow[path] += demand
+            loaded.update(path)
+        self.bushes[k] = bush
+        self.orders[k] = self._topological_order(k)
+        if loaded:
+            self._refresh(list(loaded))
+
+    def _update_bush(self, k: int):
+        bush = self.bushes[k]
+        cost = self.arrays.cost.tolist()
+        _, minPred = self._labels(k, cost, maximum=False, usedOnly=False)
+        keep = set(minPred)
+        unused = [link for link, flow in bush.items() if flow <= self.flowTolerance and link not in keep]
+        for link in unused:
+            self.arrays.flow[link] -= bush.pop(link)
+        if unused:
+            self.orders[k] = self._topological_order(k)
+
+        maxLabel, _ = self._labels(k, cost, maximum=True, usedOnly=False)
+        added = False
+        for link, (tail, head) in enumerate(zip(self.link_tail, self.link_head)):
+            if link not in bush and maxLabel[tail] > -np.inf and maxLabel[tail] + cost[link] < maxLabel[head]:
+                bush[link] = 0.0
+                added = True
+        if added:
+            self.orders[k] = self._topological_order(k)
+
+    def _equilibrate(self, k: int):
+        arrays = self.arrays
+        bush = self.bushes[k]
+        origin = self.origins[k]
+        link_tail = self.link_tail
+        cost = arrays.cost.tolist()
+        minLabel, minPred = self._labels(k, cost, maximum=False, usedOnly=False)
+        maxLabel, maxPred = self._labels(k, cost, maximum=True, usedOnly=True)
+        for node in reversed(self.orders[k]):
+            if node == origin or maxPred[node] == -1 or maxPred[node] == minPred[node]:
+                continue
+            if maxLabel[node] - minLabel[node] <= 1e-12 * max(minLabel[node], 1.0):
+                continue
+
+            # shortest path back to the origin, then longest used path back to the first node on it
+            minNodes = {node: 0}
+            minSegment = []
+            current = node
+            while current != origin:
+                minSegment.append(minPred[current])
+                current = link_tail[minPred[current]]
+                minNodes[current] = len(minSegment)
+            maxSegment = [maxPred[node]]
+            current = link_tail[maxPred[node]]
+            while current not in minNodes and maxPred[current] != -1:
+                maxSegment.append(maxPred[current])
+                current = link_tail[maxPred[current]]
+            if current not in minNodes:
+                continue
+            minSegment = minSegment[:minNodes[current]]
+
+            difference = arrays.cost[maxSegment].sum() - arrays.cost[minSegment].sum()
+            if difference <= 0:
+                continue
+            denominator = self.derivative[maxSegment].sum() + self.derivative[minSegment].sum()
+            maxShift = min(bush[link] for link in maxSegment)
+            shift = maxShift if denominator <= 0 else min(maxShift, difference / denominator)
+            if shift <= 0:
+                continue
+            for link in maxSegment:
+                bush[link] -= shift
+            for link in minSegment:
+                bush[link] += shift
+            arrays.flow[maxSegment] -= shift
+            arrays.flow[minSegment] += shift
+            self._refresh(maxSegment + minSegment)
+
+    def sweep(self):
+        """
+        One Algorithm B iteration over all the bushes, arrays.flow and arrays.cost are updated in place
+        """
+        derivative = link_cost_derivatives(self.arrays, self.optimal, self.costFunction)
+        self.derivative[:] = 0.0 if derivative is None else derivative
+        for k in range(len(self.origins)):
+            if not self.ods[k]:
+                continue
+            if self.bushes[k] is None:
+                self._initialize(k)
+            else:
+                self._update_bush(k)
+            for _ in range(self.passes):
+                self._equilibrate(k)
+
+    def _cancel_cycles(self, k: int):
+        """
+        Removes the flow around the directed cycles of the bush links (which leaves the flow reaching every node
+        unchanged) until the bush is acyclic, returns its topological order or None if some flow does not come from
+        the origin
+        """
+        bush = self.bushes[k]
+        while True:
+            order = self._topological_order(k)
+            ordered = set(order)
+            remaining = [self.link_head[link] for link in bush if self.link_head[link] not in ordered]
+            if not remaining:
+                return order
+            # walk back along the links coming from unordered nodes until a node repeats
+            node = remaining[0]
+            position = {}
+            walk = []
+            while node not in position:
+                position[node] = len(walk)
+                inLink = next((link for link, tail in self.in_links[node] if link in bush and tail not in ordered), None)
+                if inLink is None:
+                    return None
+                walk.append(inLink)
+                node = self.link_tail[inLink]
+            cycle = walk[position[node]:]
+            cycleFlow = min(bush[link] for link in cycle)
+            for link in cycle:
+                bush[link] -= cycleFlow
+                if bush[link] <= self.flowTolerance:
+                    del bush[link]
+
+    def load(self, odLinkFlows: tuple):
+        """
+        Warm start from the link flows of the OD pairs given as (od indices, link indices, flows). The bush of an origin
+        is made of the links used by its flow, without the flow around cycles, extended to the other nodes; origins
+        whose flow does not all come from the origin are initialized from scratch by the next sweep. arrays.flow is rebuilt from the bushes
+        """
+        arrays = self.arrays
+        adjacency = arrays.shortestPaths.adjacency
+        odOrigin = {od: k for k, ods in enumerate(self.ods) for od in ods}
+        originFlows = [{} for _ in self.origins]
+        for od, link, flow in zip(*(column.tolist() for column in odLinkFlows)):
+            k = odOrigin.get(od)
+            if k is not None:
+                originFlows[k][link] = originFlows[k].get(link, 0.0) + flow
+
+        arrays.flow[:] = 0.0
+        for k, flows in enumerate(originFlows):
+            bush = {link: flow for link, flow in flows.items() if flow > self.flowTolerance}
+            if not bush:
+                continue
+            self.bushes[k] = bush
+            order = self._cancel_cycles(k)
+            if order is None:
+                self.bushes[k] = None
+                continue
+            ordered = set(order)
+            # links to the nodes the flow does not reach, each of them gets a single incoming link
+            i = 0
+            while i < len(order):
+                for link, head in adjacency[order[i]]:
+                    if head not in ordered:
+                        bush[link] = 0.0
+                        ordered.add(head)
+                        order.append(head)
+                i += 1
+            self.orders[k] = order
+            for link, flow in bush.items():
+                arrays.flow[link] += flow
+
+    def origin_link_flows(self) -> np.ndarray:
+        """
+        Returns the link flows of every origin (origins x links)
+        """
+        flows = np.zeros((len(self.origins), self.arrays.numLinks))
+        for k, bush in enumerate(self.bushes):
+            if bush:
+                flows[k, list(bush.keys())] = list(bush.values())
+        return flows
+
+    def od_link_flows(self) -> tuple:
+        """
+        Returns the link flows of the OD pairs as (od indices, link indices, flows). The flow of an OD pair reaching
+        a node is split over the incoming bush links in proportion to the flow of the origin on them
+        """
+        arrays = self.arrays
+        ods, links, flows = [], [], []
+        for k, bush in enumerate(self.bushes):
+            if not bush:
+                continue
+            origin = self.origins[k]
+            order = self.orders[k]
+            nodeFlow = [0.0] * arrays.numNodes  # flow of the origin entering every node
+            for link, flow in bush.items():
+                nodeFlow[self.link_head[link]] += flow
+            for od in self.ods[k]:
+                odNodeFlow = {int(arrays.od_dest[od]): float(arrays.od_demand[od])}
+                for node in reversed(order):
+                    through = odNodeFlow.pop(node, 0.0)
+                    if through <= 0 or node == origin or nodeFlow[node] <= 0:
+                        continue
+                    for link, tail in self.in_links[node]:
+                        flow = bush.get(link, 0.0)
+                        if flow <= 0:
+                            continue
+                        odFlow = through * flow / nodeFlow[node]
+                        ods.append(od)
+                        links.append(link)
+                        flows.append(odFlow)
+                        odNodeFlow[tail] = odNodeFlow.get(tail, 0.0) + odFlow
+        return np.array(ods, dtype=np.int64), np.array(links, dtype=np.int64), np.array(flows)
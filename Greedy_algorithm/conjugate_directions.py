@@ -0,0 +1,78 @@
+import numpy as np
+
+from cost_kernels import link_cost_derivatives
+
+
+def cfw_weights(hessian: np.ndarray,
+                flow: np.ndarray,
+                aon: np.ndarray,
+                target: np.ndarray,
+                delta: float = 0.01
+                ) -> list:
+    """
+    Conjugate Frank-Wolfe (Mitradjieva and Lindberg, 2013): the new target point alpha * target + (1 - alpha) * aon
+    gives a search direction conjugate (with respect to the diagonal hessian) to the previous one.
+
+    :return: weights of [aon, target]
+    """
+    previous = hessian * (target - flow)
+    numerator = float(np.dot(previous, aon - flow))
+    denominator = float(np.dot(previous, aon - target))
+    alpha = 0.0
+    if denominator != 0:
+        alpha = min(max(numerator / denominator, 0.0), 1 - delta)
+    return [1 - alpha, alpha]
+
+
+def bfw_weights(hessian: np.ndarray,
+                flow: np.ndarray,
+                aon: np.ndarray,
+                target: np.ndarray,
+                previousTarget: np.ndarray,
+                previousStep: float,
+                delta: float = 0.01
+                ) -> list:
+    """
+    Bi-conjugate Frank-Wolfe (Mitradjieva and Lindberg, 2013): the new target point is a combination of the
+    all-or-nothing loading and the two previous target points giving a direction conjugate to the two previous ones.
+    Falls back to the conjugate direction when the last step reached the target point.
+
+    :return: weights of [aon, target, previousTarget]
+    """
+    if previousStep >= 1 - delta:
+        return cfw_weights(hessian, flow, aon, target, delta) + [0.0]
+    descent = aon - flow
+    direction1 = target - flow
+    direction2 = previousStep * target - flow + (1 - previousStep) * previousTarget
+    denominator1 = float(np.dot(hessian * direction1, direction1))
+    denominator2 = float(np.dot(hessian * direction2, previousTarget - target))
+    if denominator1 == 0 or denominator2 == 0:
+        return cfw_weights(hessian, flow, aon, target, delta) + [0.0]
+
+    mu = max(-float(np.dot(hessian * direction2, descent)) / denominator2, 0.0)
+    nu = max(-float(np.dot(hessian * direction1, descent)) / denominator1 + mu * previousStep / (1 - previousStep), 0.0)
+    beta0 = 1 / (1 + mu + nu)
+    return [beta0, nu * beta0, mu * beta0]
+
+
+def target_weights(algorithm: str,
+                   arrays,
+                   optimal: bool,
+                   costFunction,
+                   aon: np.ndarray,
+                   targets: list,
+                   previousStep: float
+                   ) -> list:
+    """
+    Weights of the all-or-nothing loading and of the previous target points (most recent first) defining the target
+    point of the "FW", "CFW" or "BFW" iteration. Frank-Wolfe is used when there are no previous targets or when the
+    cost function has no derivative kernel.
+    """
+    hessian = None
+    if algorithm != "FW" and targets:
+        hessian = link_cost_derivatives(arrays, optimal, costFunction)
+    if hessian is None:
+        return [1.0]
+    if algorithm == "BFW" and len(targets) > 1:
+        return bfw_weights(hessian, arrays.flow, aon, targets[0], targets[1], previousStep)
+    return cfw_weights(hessian, arrays.flow, aon, targets[0])
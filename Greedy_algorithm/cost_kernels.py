@@ -0,0 +1,231 @@
+import numpy as np
+
+# Cost returned for closed links (capacity < 1e-3), same value as the scalar cost functions
+CLOSED_LINK_COST = np.finfo(np.float32).max
+
+
+def vectorized(kernel, derivative=None):
+    """
+    Decorator attaching an array kernel to a scalar cost function.
+    The kernel has the same signature as the scalar function but receives arrays with one entry per link,
+    the optional derivative kernel (same signature) returns the derivative of the cost with respect to the flow
+    """
+    def attach(costFunction):
+        costFunction.vectorized = kernel
+        costFunction.derivative = derivative
+        return costFunction
+    return attach
+
+
+def bpr_costs(optimal: bool,
+              fft: np.ndarray,
+              alpha: np.ndarray,
+              flow: np.ndarray,
+              capacity: np.ndarray,
+              beta: np.ndarray,
+              length: np.ndarray = None,
+              maxSpeed: np.ndarray = None
+              ) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        congestion = alpha * np.power(flow / capacity, beta)
+    if optimal:
+        congestion = congestion * (beta + 1)
+    return np.where(capacity < 1e-3, CLOSED_LINK_COST, fft * (1 + congestion))
+
+
+def bpr_derivatives(optimal: bool,
+                    fft: np.ndarray,
+                    alpha: np.ndarray,
+                    flow: np.ndarray,
+                    capacity: np.ndarray,
+                    beta: np.ndarray,
+                    length: np.ndarray = None,
+                    maxSpeed: np.ndarray = None
+                    ) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derivative = fft * alpha * beta * np.power(flow / capacity, beta - 1) / capacity
+    if optimal:
+        derivative = derivative * (beta + 1)
+    return np.where((capacity < 1e-3) | (flow <= 0), 0.0, derivative)
+
+
+def bpr_noise_costs(optimal: bool,
+                    fft: np.ndarray,
+                    alpha: np.ndarray,
+                    flow: np.ndarray,
+                    capacity: np.ndarray,
+                    beta: np.ndarray,
+                    length: np.ndarray = None,
+                    maxSpeed: np.ndarray = None,
+                    noiseFlow: np.ndarray = 0.0
+                    ) -> np.ndarray:
+    """
+    BPR costs when the link also carries a fixed noise flow, the marginal cost (optimal=True)
+    only accounts for the share of the flow that is being optimized
+    """
+    full_flow = flow + noiseFlow
+    with np.errstate(divide="ignore", invalid="ignore"):
+        congestion = alpha * np.power(full_flow / capacity, beta)
+        if optimal:
+            ratio = np.where(full_flow > 1e-6, flow / full_flow, 0.0)
+            congestion = congestion * (beta * ratio + 1)
+    cost = np.where(full_flow < 1e-6, fft, fft * (1 + congestion))
+    return np.where(capacity < 1e-3, CLOSED_LINK_COST, cost)
+
+
+def bpr_noise_derivatives(optimal: bool,
+                          fft: np.ndarray,
+                          alpha: np.ndarray,
+                          flow: np.ndarray,
+                          capacity: np.ndarray,
+                          beta: np.ndarray,
+                          length: np.ndarray = None,
+                          maxSpeed: np.ndarray = None,
+                          noiseFlow: np.ndarray = 0.0
+                          ) -> np.ndarray:
+    full_flow = flow + noiseFlow
+    with np.errstate(divide="ignore", invalid="ignore"):
+        congestion = alpha * np.power(full_flow / capacity, beta)
+        derivative = fft * alpha * beta * np.power(full_flow / capacity, beta - 1) / capacity
+        if optimal:
+            ratio = flow / full_flow
+            derivative = derivative * (beta * ratio + 1) + fft * congestion * beta * noiseFlow / full_flow ** 2
+    return np.where((capacity < 1e-3) | (full_flow < 1e-6), 0.0, derivative)
+
+
+def constant_costs(optimal: bool,
+                   fft: np.ndarray,
+                   alpha: np.ndarray,
+                   flow: np.ndarray,
+                   capacity: np.ndarray = None,
+                   beta: np.ndarray = None,
+                   length: np.ndarray = None,
+                   maxSpeed: np.ndarray = None,
+                   noiseFlow: np.ndarray = None
+                   ) -> np.ndarray:
+    if optimal:
+        return fft + flow
+    return np.array(fft, dtype=np.float64, copy=True)
+
+
+def constant_derivatives(optimal: bool,
+                         fft: np.ndarray,
+                         alpha: np.ndarray,
+                         flow: np.ndarray,
+                         capacity: np.ndarray = None,
+                         beta: np.ndarray = None,
+                         length: np.ndarray = None,
+                         maxSpeed: np.ndarray = None,
+                         noiseFlow: np.ndarray = None
+                         ) -> np.ndarray:
+    return np.full(np.shape(flow), 1.0 if optimal else 0.0)
+
+
+def greenshields_costs(optimal: bool,
+                       fft: np.ndarray,
+                       alpha: np.ndarray,
+                       flow: np.ndarray,
+                       capacity: np.ndarray,
+                       beta: np.ndarray,
+                       length: np.ndarray,
+                       maxSpeed: np.ndarray,
+                       noiseFlow: np.ndarray = 0.0
+                       ) -> np.ndarray:
+    full_flow = flow + noiseFlow
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if optimal:
+            cost = (length * (capacity ** 2)) / (maxSpeed * (capacity - full_flow) ** 2)
+        else:
+            cost = length / (maxSpeed * (1 - (full_flow / capacity)))
+    return np.where(capacity < 1e-3, CLOSED_LINK_COST, cost)
+
+
+def greenshields_derivatives(optimal: bool,
+                             fft: np.ndarray,
+                             alpha: np.ndarray,
+                             flow: np.ndarray,
+                             capacity: np.ndarray,
+                             beta: np.ndarray,
+                             length: np.ndarray,
+                             maxSpeed: np.ndarray,
+                             noiseFlow: np.ndarray = 0.0
+                             ) -> np.ndarray:
+    full_flow = flow + noiseFlow
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if optimal:
+            derivative = 2 * length * (capacity ** 2) / (maxSpeed * (capacity - full_flow) ** 3)
+        else:
+            derivative = length * capacity / (maxSpeed * (capacity - full_flow) ** 2)
+    return np.where(capacity < 1e-3, 0.0, derivative)
+
+
+def _link_columns(arrays, flow: np.ndarray, capacity: np.ndarray) -> list:
+    if flow is None:
+        flow = arrays.flow
+    if capacity is None:
+        capacity = arrays.capacity
+    columns = [arrays.fft, arrays.alpha, flow, capacity, arrays.beta, arrays.length, arrays.speedLimit]
+    if arrays.has_noise_flow:
+        columns.append(arrays.noise_flow)
+    return columns
+
+
+def link_costs(arrays, optimal: bool, costFunction, flow: np.ndarray = None, capacity: np.ndarray = None) -> np.ndarray:
+    """
+    Evaluates the cost function on every link of the array network at once.
+    Cost functions decorated with a vectorized kernel are evaluated in a single numpy call,
+    any other function with the scalar signature is evaluated link by link.
+
+    :param arrays: ArrayNetwork with the link parameters
+    :param optimal: True for the marginal (system optimal) costs
+    :param costFunction: scalar cost function, e.g. BPRcostFunction
+    :param flow: link flows, the current flows of the network by default
+    :param capacity: link capacities, the current capacities of the network by default
+    :return: array of link costs
+    """
+    columns = _link_columns(arrays, flow, capacity)
+    kernel = getattr(costFunction, "vectorized", None)
+    if kernel is not None:
+        return kernel(optimal, *columns)
+    return np.array([costFunction(optimal, *link) for link in zip(*(c.tolist() for c in columns))], dtype=np.float64)
+
+
+def link_cost_derivatives(arrays, optimal: bool, costFunction, flow: np.ndarray = None, capacity: np.ndarray = None):
+    """
+    Evaluates the derivative of the cost function with respect to the flow on every link,
+    returns None if the cost function has no derivative kernel
+    """
+    derivative = getattr(costFunction, "derivative", None)
+    if derivative is None:
+        return None
+    return derivative(optimal, *_link_columns(arrays, flow, capacity))
+
+
+def refresh_links(arrays, links: np.ndarray, optimal: bool, costFunction, derivative: np.ndarray):
+    """
+    Recomputes arrays.cost and the cost derivatives (stored in derivative) of the given links after their flows changed,
+    flows pushed slightly below zero by round off are clipped
+    """
+    flow = np.maximum(arrays.flow[links], 0.0)
+    arrays.flow[links] = flow
+    subset = LinkSubset(arrays, links)
+    arrays.cost[links] = link_costs(subset, optimal, costFunction, flow=flow)
+    derivatives = link_cost_derivatives(subset, optimal, costFunction, flow=flow)
+    derivative[links] = 0.0 if derivatives is None else derivatives
+
+
+class LinkSubset:
+    """
+    Restriction of the link parameters of an ArrayNetwork to the links selected by a mask or an index array,
+    so that only the links whose flow changes are evaluated
+    """
+
+    def __init__(self, arrays, mask: np.ndarray):
+        self.fft = arrays.fft[mask]
+        self.alpha = arrays.alpha[mask]
+        self.beta = arrays.beta[mask]
+        self.length = arrays.length[mask]
+        self.speedLimit = arrays.speedLimit[mask]
+        self.capacity = arrays.capacity[mask]
+        self.has_noise_flow = arrays.has_noise_flow
+        self.noise_flow = arrays.noise_flow[mask]
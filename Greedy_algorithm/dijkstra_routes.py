@@ -1,9 +1,8 @@
-import networkx as nx
-import numpy as np
 import matplotlib.pyplot as plt
 from os import listdir
 from os.path import isfile, join
-from utils import round_trip_time_and_flow, PATH, _debug, ROUND, OD_pair, Route
+from utils import PATH, _debug, ROUND, OD_pair, Route
+from od_results import ODResults
 # in this file I create routes from times and flows on each segment using Dijkstra algorithm for finding shortest path in the graph.
 
 
@@ -13,37 +12,15 @@ def read_input(filename: str, pairs: list):
     Read the input file and create OD pairs using the graph representing the network
     
     Parameters:
-        filename: str - the name of the file to read
+        filename: str - the name of the file to read, a *_OD_pairs.txt file (or .txt.gz) or its binary *_OD_pairs.npz
+                        counterpart
         pairs: list - the list of OD pairs to be filled
     
     Returns:
         None
     '''
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-        # skip the header
-        lines = lines[3:]
-        # read the pairs
-        i = 0
-        while i < len(lines):
-            origin, destination, flow = lines[i].split()
-            flow = float(flow)
-            pair = OD_pair(origin, destination, flow)
-            # read the graph
-            graph = nx.DiGraph()
-            for j in range(i+1, len(lines)):
-                edge = lines[j]
-                if edge == '\n':
-                    i = j + 1
-                    break
-                origin, destination, flow, time = round_trip_time_and_flow(edge, ROUND)
-                graph.add_edge(origin, destination, flow=flow, time=time)
-            pair.add_graph(graph)
-            if pair.flow > 0:
-                # we consider only pairs with flow > 0
-                pairs.append(pair)
+    pairs.extend(ODResults.load(filename).pairs(ROUND))
 
-        
     if _debug:
         for pair in pairs:
             print(pair.origin, pair.destination, pair.flow)
@@ -98,27 +75,38 @@ def average_paths(pairs: list):
     return pairs
             
 
+def write_header(f):
+    f.write("origin destination total_flow\n")
+    f.write("time flow nodes_in_path\n")
+
+
+def write_pair(f, pair: OD_pair):
+    '''
+    Write the routes of an OD pair to an open routes file (see write_results)
+    '''
+    f.write(f'{pair.origin} {pair.destination} {pair.flow}\n')
+    for route in pair.routes:
+        f.write(f'{route.time} {route.flow} ')
+        for node in route.path:
+            f.write(f'{node} ')
+        f.write('\n')
+    f.write('\n')
+
+
 def write_results(filename: str, pairs: list, asignment_type = 'SO'):    
     with open(filename, 'w') as f:
-        f.write("origin destination total_flow\n")
-        f.write("time flow nodes_in_path\n")
+        write_header(f)
         for pair in pairs:
             # ignore pairs with only one route
             if asignment_type == 'SO':
                 if len(pair.routes) == 1:
                     continue
-            f.write(f'{pair.origin} {pair.destination} {pair.flow}\n')
-            for route in pair.routes:
-                f.write(f'{route.time} {route.flow} ')
-                for node in route.path:
-                    f.write(f'{node} ')
-                f.write('\n')        
-            f.write('\n')
+            write_pair(f, pair)
     
 
 def calculate_routes(pairs: list):
     '''
-    Calculate the routes for each OD pair using Dijkstra algorithm from the graph
+    Calculate the routes for each OD pair by repeatedly taking the fastest route of its flow graph (see od_graph.py)
     
     Parameters:
         pairs: list - the list of OD pairs
@@ -128,53 +116,20 @@ def calculate_routes(pairs: list):
     '''
     for pair in pairs:
         graph = pair.graph
-        routes = {}
         o = pair.origin
         d = pair.destination
         
-        # if _debug:
-        #     print(o, d)
-        #     print(graph.edges(data=True))
-        #     #plot graph
-        #     pos = nx.spring_layout(graph)
-        #     nx.draw(graph, pos, with_labels=True)
-        #     labels = nx.get_edge_attributes(graph, 'time')
-        #     nx.draw_networkx_edge_labels(graph, pos, edge_labels=labels)
-        #     plt.show()
-        
-        while True:
-            try:
-                if _debug:
-                    print("Calculating route from", o, "to", d)
-                route = nx.dijkstra_path(graph, o, d, weight='time')
-                routes[(o, d)] = route
-                # find the minimum flow on the route
-                min_flow = np.inf
-                for i in range(len(route) - 1):
-                    if graph[route[i]][route[i+1]]['flow'] < min_flow:
-                        min_flow = graph[route[i]][route[i+1]]['flow']
-                # update the flow on the route
-                for i in range(len(route) - 1):
-                    graph[route[i]][route[i+1]]['flow'] -= min_flow
-                
-                sum_time = 0
-                for i in range(len(route) - 1):
-                    sum_time += graph[route[i]][route[i+1]]['time']
-                od_route = Route(sum_time, min_flow, pair.get_num_routes(), route)
-                  
-                # remove the empty edges
-                for i in range(len(route) - 1):
-                    if graph[route[i]][route[i+1]]['flow'] == 0:
-                        graph.remove_edge(route[i], route[i+1])
-                if od_route.flow != 0:
-                    pair.add_routes(od_route)
-                if _debug:
-                    print("route:", route)
-                    print(min_flow)
-                    print(sum_time)
-                    print()
-            except nx.NetworkXNoPath:
-                break
+        if o not in graph or d not in graph or o == d:
+            continue
+        if _debug:
+            print("Calculating routes from", o, "to", d)
+        for time, flow, path in graph.decompose(o, d):
+            pair.add_routes(Route(time, flow, pair.get_num_routes(), path))
+            if _debug:
+                print("route:", path)
+                print(flow)
+                print(time)
+                print()
     return pairs
         
 
@@ -1,8 +1,9 @@
 import math
 import csv
+import hashlib
 from functools import reduce
+import numpy as np
 import pandas as pd
-from utils import Route, Agent
 
 
 
@@ -24,136 +25,353 @@ def prep_data(route_data):
     total_agents = sum(q for q, _ in route_data)
     return total_agents, route_data
 
-def run_simulation(num_agents, route_data, thresholds=[], max_steps=10000, eps=0.0, debug=False):
+HISTORY_MODES = ("full", "last", "sampled", "periodic", "none")
+
+
+def history_dtype(num_routes):
+    """
+    Smallest unsigned integer type holding the route indices
+    """
+    if num_routes <= np.iinfo(np.uint8).max + 1:
+        return np.uint8
+    if num_routes <= np.iinfo(np.uint16).max + 1:
+        return np.uint16
+    return np.uint32
+
+
+def _state_key(sum_time, agent_id):
+    """
+    Digest of the state of the simulation after a day: the order of the agents and their sums of times relative to
+    the lowest one in thousandths. With route times of at most 3 decimals (see ROUND in utils.py) two days with the
+    same state are followed by the same days.
+    """
+    relative = np.rint((sum_time - sum_time[0]) * 1000).astype(np.int64)
+    return hashlib.blake2b(agent_id.tobytes() + relative.tobytes(), digest_size=16).digest()
+
+
+class _History:
+    """
+    Routes taken by the agents (rows of route indices by agent id) in a preallocated matrix, depending on the mode:
+        - full: every day
+        - last: the last size days
+        - sampled: every size-th day
+        - periodic: every day until the state of the simulation repeats (period set by run_simulation), the
+          following days repeat the period
+        - none: no day
+    """
+
+    def __init__(self, mode, size, max_steps, num_agents, num_routes):
+        if mode not in HISTORY_MODES:
+            raise ValueError(f"history_mode must be one of {HISTORY_MODES}, got {mode}")
+        if mode in ("last", "sampled") and (size is None or size < 1):
+            raise ValueError(f'history_size must be a positive number of days for the "{mode}" history')
+        rows = {"full": max_steps, "periodic": max_steps, "none": 0,
+                "last": min(size or 0, max_steps), "sampled": max_steps // (size or 1)}[mode]
+        self.mode = mode
+        self.size = size
+        self.rows = np.zeros((rows, num_agents), dtype=history_dtype(num_routes))
+        self.steps = np.zeros(rows, dtype=np.int64)  # day of every row
+        self.count = 0
+        self.period = None  # (last day before the period, period length) once the simulation is periodic
+
+    def record(self, step, agent_id, assigned_routes):
+        if self.mode == "none" or self.period is not None or (self.mode == "sampled" and step % self.size):
+            return
+        row = self.count % len(self.rows) if self.mode == "last" else self.count
+        self.rows[row, agent_id] = assigned_routes
+        self.steps[row] = step
+        self.count += 1
+
+    def result(self):
+        if self.mode == "last" and self.count > len(self.rows):
+            order = np.roll(np.arange(len(self.rows)), -(self.count % len(self.rows)))
+            return self.rows[order], self.steps[order]
+        return self.rows[:self.count], self.steps[:self.count]
+
+
+def run_simulation(num_agents, route_data, thresholds=[], max_steps=10000, eps=0.0, debug=False,
+                   history_mode="full", history_size=None, stop_on_cycle=False):
     """
     Runs the simulation for a given number of agents and route data.
+    Every day the agents with the lowest sum of times so far take the slowest routes: the agents are kept sorted by
+    their sum of times (numpy arrays in the order of the agents, sorted with a stable argsort after every day) and
+    the routes are laid over that order once with np.repeat.
 
     Parameters:
         num_agents (int): The number of agents.
         route_data (list of Route object): Each tuple represents a route as (flow, time), where flow is the number of agents that can take this route, and time is the associated time.
         thresholds (list of float): A list of convergence thresholds other than absolute convergence. Default is an empty list.
         max_steps (int): The maximum number of simulation steps. Default is 10,000.
+        history_mode (str): Days kept in the history, "full", "last" (the last history_size days), "sampled" (every
+            history_size-th day), "periodic" (until the simulation repeats itself) or "none". Default is "full".
+        history_size (int): The window or the sampling interval of the "last" and "sampled" histories.
+        stop_on_cycle (bool): Stop as soon as the state after a day (see _state_key) was already seen, from then on
+            the simulation cycles. The daily series end at that day and the rest is derived from the cycle.
 
     Returns:
         dict: A dictionary containing the history of agent positions, mean times, variances and fairness for each step.
+        The history is a matrix (days x agents) of route indices (routes sorted from the slowest), history_steps gives
+        the day of every row and history_period is (s, p) when the periodic history found that the days s + 1 to
+        s + p form a cycle (every day from s + p + 1 on repeats the day p days before), None otherwise.
+        cycle is (s, p) when the simulation was found to cycle from day s + 1 on, with the same meaning as
+        history_period, every agent then gains the same time per cycle and cycle_mean is its daily average (by agent
+        id). mean_final and variance_final are the mean and the variance of the sums of times after max_steps days
+        (None when max_steps is 0), also when the simulation stopped on the cycle, and steps the number of simulated
+        days. The convergence and the almost convergence days after the stop are computed from the cycle.
     """
-    agents = [Agent(i) for i in range(num_agents)]
-    routes = [Route(t,q,j) for j, (q, t) in enumerate(route_data)]
-    history = []
+    # slowest route first, routes with the same time keep their order
+    routes = sorted(route_data, key=lambda r: r[1], reverse=True)
+    route_flow = np.array([q for q, _ in routes], dtype=np.int64)
+    route_time = np.array([t for _, t in routes], dtype=np.float64)
+    # route of every position in the sorted agents, agents beyond the total flow take the first route
+    assigned_routes = np.zeros(num_agents, dtype=np.int64)
+    assigned = np.repeat(np.arange(len(routes)), route_flow)[:num_agents]
+    assigned_routes[:len(assigned)] = assigned
+    assigned_times = route_time[assigned_routes]
+
+    agent_id = np.arange(num_agents)  # agents in the sorted order
+    sum_time = np.zeros(num_agents)
+    sum_deviation = np.zeros(num_agents)
+    history = _History(history_mode, history_size, max_steps, num_agents, len(routes))
+    route_counts = np.zeros((num_agents, len(routes)), dtype=np.int64) if debug else None
     mean = []
     variance = []
     fairness = []
     fairness_norm = []
     almost_convergence = [-1] * len(thresholds)
+    detect_cycle = stop_on_cycle or history_mode == "periodic"
+    seen = {}  # state digest -> day
+    lowest = []  # lowest sum of times after every day
+    cycle = None
 
-    def prepare_routes():
-        # min_time = min(routes, key=lambda r: r.time).time
-        # for route in routes:
-        #     route.time -= min_time
-        routes.sort()
-
-    def assign_routes(routes, agents):
-        assigned_routes = [0] * len(agents)
-        idx = 0
-        for i in range(len(routes)):
-            for j in range(routes[i].flow):
-                if idx < len(agents):
-                    assigned_routes[idx] = i
-                    idx += 1
-        return assigned_routes
-
-    def simulation_step():
-        assigned_routes = assign_routes(routes, agents)
-
-        for i in range(len(agents)):
-            agents[i].add_time(routes[assigned_routes[i]].time, mean_time)
-
-        agent_history = [0] * len(agents)
-
-        for i in range(len(agents)):
-            agent_history[agents[i].id] = assigned_routes[i]
-        if debug:
-            for agent in agents:
-                print(f"Agent {agent.id} has time {agent.sum_time}")
-        step_mean = sum(agent.sum_time for agent in agents) / len(agents)
-        step_variance = sum((agent.sum_time - step_mean) ** 2 for agent in agents) / len(agents)
-        step_fairness = sum(pow(agent.sum_deviation, 2) for agent in agents) / (len(agents))
-        history.append(agent_history)
-        mean.append(step_mean)
-        variance.append(step_variance)
-        fairness.append(step_fairness)
-        fairness_norm.append(step_fairness / step_mean) # fairness normalized by mean time
-        if(len(mean) != len(variance)):
-            print("Error: mean and variance are not the same length")
-            print("Mean: ", len(mean))
-            print("Variance: ", len(variance))
-        agents.sort()
-
-    def check_convergence(eps, cntr):
-        min_time = min(agents, key=lambda a: a.sum_time).sum_time
-        max_time = max(agents, key=lambda a: a.sum_time).sum_time
-        max_diff = max_time - min_time
-        if max_diff > eps:
-            if debug:
-                print(f"Not converged yet! Max diff: {max_diff}")
-            return False
-        if debug:
-            print(f"Converged in {cntr} steps!")
-        return True
-    
-    def norm_fairness_convergence(eps):
-        # if fairness is less than eps
-        if fairness_norm[-1] < eps:
-            return True
-        return False
-    
-    # Prepare and run the simulation
-    prepare_routes()
     cntr = 0
     converged = False
     convergence_iter = -1
-    mean_time = sum(route.flow * route.time for route in routes) / num_agents
+    mean_time = sum(q * t for q, t in routes) / num_agents
+    deviation = assigned_times - mean_time
     if debug:
         print(f"Mean time: {mean_time}")
-        print(f"Initial routes:" + str([(r.flow, r.time) for r in routes]))
+        print(f"Initial routes:" + str([(q, t) for q, t in routes]))
     while cntr < max_steps:
+        # rounded to 3 decimals like Agent.add_time
+        sum_time = np.round((sum_time + assigned_times) * 1000) / 1000
+        sum_deviation += deviation
         cntr += 1
-        simulation_step()
-        if cntr % len(agents) == 0 and debug:
+        history.record(cntr, agent_id, assigned_routes)
+        if debug:
+            route_counts[agent_id, assigned_routes] += 1
+            for i in range(num_agents):
+                print(f"Agent {agent_id[i]} has time {sum_time[i]}")
+        # sequential sums (cumsum) in the order of the agents, as the sums over the agents list
+        step_mean = np.cumsum(sum_time)[-1] / num_agents
+        step_variance = np.cumsum((sum_time - step_mean) ** 2)[-1] / num_agents
+        step_fairness = np.cumsum(sum_deviation ** 2)[-1] / num_agents
+        mean.append(float(step_mean))
+        variance.append(float(step_variance))
+        fairness.append(float(step_fairness))
+        fairness_norm.append(float(step_fairness / step_mean)) # fairness normalized by mean time
+
+        order = np.argsort(sum_time, kind="stable")
+        sum_time = sum_time[order]
+        sum_deviation = sum_deviation[order]
+        agent_id = agent_id[order]
+
+        if cntr % num_agents == 0 and debug:
             print(f"Step {cntr} stats:")
             # print for each agent number of times it has been assigned to each route
-            for i in range(len(agents)):
-                tab = [0] * len(routes)
-                for j in range(len(history)):
-                    tab[history[j][i]] += 1
+            for i in range(num_agents):
+                tab = route_counts[i].tolist()
                 print(f"Agent {i} has been assigned to routes: {tab}")
         for i, threshold in enumerate(thresholds):
-            if almost_convergence[i] == -1 and norm_fairness_convergence(threshold):
+            if almost_convergence[i] == -1 and fairness_norm[-1] < threshold:
                 almost_convergence[i] = cntr
 
-        if check_convergence(eps, cntr):
+        max_diff = sum_time[-1] - sum_time[0]
+        if max_diff > eps:
+            if debug:
+                print(f"Not converged yet! Max diff: {max_diff}")
+        else:
+            if debug:
+                print(f"Converged in {cntr} steps!")
             if not converged:
                 convergence_iter = cntr
             converged = True
 
+        if detect_cycle and cycle is None:
+            lowest.append(sum_time[0])
+            previous = seen.setdefault(_state_key(sum_time, agent_id), cntr)
+            if previous != cntr:
+                cycle = (previous, cntr - previous)
+                history.period = cycle
+                seen = None
+                if stop_on_cycle:
+                    break
+
+    mean_final = mean[-1] if mean else None
+    variance_final = variance[-1] if variance else None
+    cycle_mean = None
+    if cycle is not None:
+        start, length = cycle
+        # every agent gains the same time over a cycle (the states differ only by it)
+        gain = lowest[start + length - 1] - lowest[start - 1]
+        cycle_mean = np.full(num_agents, gain / length)
+        if cntr < max_steps and gain > 0:
+            # the days after the stop repeat the days of the cycle with the sums of times increased by the gain,
+            # the spread of the sums and the deviations (fairness) are periodic
+            day = start + (max_steps - start - 1) % length + 1
+            mean_final = mean[day - 1] + (max_steps - day) // length * gain
+            variance_final = variance[day - 1]
+            for i, threshold in enumerate(thresholds):
+                if almost_convergence[i] != -1:
+                    continue
+                for day in range(start + 1, start + length + 1):
+                    cycles = max(1, math.floor((fairness[day - 1] / threshold - mean[day - 1]) / gain) + 1)
+                    first = day + cycles * length
+                    if first <= max_steps and (almost_convergence[i] == -1 or first < almost_convergence[i]):
+                        almost_convergence[i] = first
+
     # Return the simulation results
+    history_rows, history_steps = history.result()
     return {
         "convergence": (converged, convergence_iter),
-        "history": history,
+        "history": history_rows,
+        "history_steps": history_steps,
+        "history_period": history.period,
         "mean": mean,
         "variance": variance,
         "fairness": fairness,
         "fairness_norm": fairness_norm,
-        "almost_convergence": almost_convergence
+        "almost_convergence": almost_convergence,
+        "cycle": cycle,
+        "cycle_mean": cycle_mean,
+        "mean_final": mean_final,
+        "variance_final": variance_final,
+        "steps": cntr
     }
 
 
+def prep_pairs(pairs):
+    """
+    Ragged arrays of the routes of many OD pairs for run_simulations, the flows rounded and the routes without flow
+    removed as in prep_data. OD pairs left without routes are skipped.
+
+    Parameters:
+        pairs (list of OD_pair): The OD pairs with their routes.
+
+    Returns:
+        tuple: The (origin, destination) of the kept pairs, route_ptr, route_flow and route_time.
+    """
+    keys = []
+    sizes = []
+    route_flow = []
+    route_time = []
+    for pair in pairs:
+        _, route_data = prep_data(pair.routes)
+        if not route_data:
+            continue
+        keys.append((pair.origin, pair.destination))
+        sizes.append(len(route_data))
+        route_flow.extend(q for q, _ in route_data)
+        route_time.extend(t for _, t in route_data)
+    route_ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=route_ptr[1:])
+    return keys, route_ptr, np.array(route_flow, dtype=np.int64), np.array(route_time, dtype=np.float64)
+
+
+def run_simulations(route_ptr, route_flow, route_time, thresholds=[], max_steps=10000, eps=0.0, keys=None):
+    """
+    Runs the simulation of many OD pairs at once, the routes of the pair i are route_flow[route_ptr[i]:route_ptr[i + 1]]
+    (agents, all the flows are positive) and route_time over the same range. The agents of all the pairs are laid
+    in one array, segment by segment, and every day is a handful of numpy operations over all of them: the sorts,
+    sums and convergence checks of run_simulation are done per segment (lexsort on the segment and the sum of
+    times, np.add.reduceat). The results are those of run_simulation up to the order of the additions in the sums.
+
+    Parameters:
+        thresholds, max_steps, eps: As in run_simulation.
+        keys (list of tuple): The (origin, destination) of the pairs, see prep_pairs.
+
+    Returns:
+        pd.DataFrame: One row per pair with the number of agents and routes, the mean, variance, fairness and
+        normalized fairness after max_steps days, the convergence (converged, convergence_iter) and the almost
+        convergence day of every threshold (-1 if not reached).
+    """
+    route_ptr = np.asarray(route_ptr, dtype=np.int64)
+    route_flow = np.asarray(route_flow, dtype=np.int64)
+    route_time = np.asarray(route_time, dtype=np.float64)
+    num_pairs = len(route_ptr) - 1
+    route_pair = np.repeat(np.arange(num_pairs), np.diff(route_ptr))
+    # slowest route first within every pair, routes with the same time keep their order
+    route_order = np.lexsort((-route_time, route_pair))
+    agents = np.add.reduceat(route_flow, route_ptr[:-1]) if num_pairs else np.zeros(0, dtype=np.int64)
+    agent_ptr = np.zeros(num_pairs + 1, dtype=np.int64)
+    np.cumsum(agents, out=agent_ptr[1:])
+    agent_pair = np.repeat(np.arange(num_pairs), agents)
+    assigned_times = np.repeat(route_time[route_order], route_flow[route_order])
+    mean_time = np.add.reduceat(route_flow * route_time, route_ptr[:-1]) / agents if num_pairs else np.zeros(0)
+    deviation = assigned_times - mean_time[agent_pair]
+
+    sum_time = np.zeros(len(agent_pair))
+    sum_deviation = np.zeros(len(agent_pair))
+    starts = agent_ptr[:-1]
+    ends = agent_ptr[1:] - 1
+    converged = np.zeros(num_pairs, dtype=bool)
+    convergence_iter = np.full(num_pairs, -1, dtype=np.int64)
+    almost_convergence = np.full((len(thresholds), num_pairs), -1, dtype=np.int64)
+    mean = variance = fairness = np.zeros(num_pairs)
+    for cntr in range(1, max_steps + 1 if num_pairs else 1):
+        # rounded to 3 decimals like Agent.add_time
+        sum_time = np.round((sum_time + assigned_times) * 1000) / 1000
+        sum_deviation += deviation
+        mean = np.add.reduceat(sum_time, starts) / agents
+        variance = np.add.reduceat((sum_time - mean[agent_pair]) ** 2, starts) / agents
+        fairness = np.add.reduceat(sum_deviation ** 2, starts) / agents
+
+        order = np.lexsort((sum_time, agent_pair))
+        sum_time = sum_time[order]
+        sum_deviation = sum_deviation[order]
+
+        for i, threshold in enumerate(thresholds):
+            reached = (almost_convergence[i] == -1) & (fairness / mean < threshold)
+            almost_convergence[i, reached] = cntr
+        now = sum_time[ends] - sum_time[starts] <= eps
+        convergence_iter[now & ~converged] = cntr
+        converged |= now
+
+    table = pd.DataFrame({
+        "agents": agents,
+        "routes": np.diff(route_ptr),
+        "mean": mean,
+        "variance": variance,
+        "fairness": fairness,
+        "fairness_norm": fairness / mean if num_pairs else fairness,
+        "converged": converged,
+        "convergence_iter": convergence_iter,
+    })
+    for i, threshold in enumerate(thresholds):
+        table[f"almost_convergence_{threshold}"] = almost_convergence[i]
+    if keys is not None:
+        table.insert(0, "origin", [origin for origin, _ in keys])
+        table.insert(1, "destination", [destination for _, destination in keys])
+    return table
+
+
 def find_period(arr):
+    """
+    Smallest p such that arr[i] == arr[i % p] for every i, from the longest proper prefix of arr that is also
+    its suffix (Knuth-Morris-Pratt prefix function), in O(n)
+    """
     n = len(arr)
-    for p in range(1, n + 1):
-        if all(arr[i] == arr[i % p] for i in range(n)):
-            return p
-    return n  # If no period is found, return length (i.e. no repetition)
+    if n == 0:
+        return 0
+    border = [0] * n
+    k = 0
+    for i in range(1, n):
+        while k > 0 and arr[i] != arr[k]:
+            k = border[k - 1]
+        if arr[i] == arr[k]:
+            k += 1
+        border[i] = k
+    return n - border[-1]
 
 # Example usage of the run_simulation function
 if __name__ == "__main__":
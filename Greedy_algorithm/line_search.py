@@ -0,0 +1,75 @@
+import numpy as np
+
+from cost_kernels import LinkSubset, link_costs, link_cost_derivatives
+
+
+def line_search(arrays,
+                flow: np.ndarray,
+                direction: np.ndarray,
+                optimal: bool,
+                costFunction,
+                tolerance: float = 1e-8,
+                maxIter: int = 100
+                ) -> float:
+    """
+    Finds the step size in [0, 1] minimizing the (convex) assignment objective along flow + step * direction,
+    i.e. the root of the directional derivative sum(direction * cost(flow + step * direction)).
+    The derivative is increasing in the step, if it does not change sign in [0, 1] the minimum is on the boundary.
+    Uses safeguarded Newton steps when the cost function has a derivative kernel and bisection otherwise.
+
+    :param arrays: ArrayNetwork with the link parameters
+    :param flow: current link flows
+    :param direction: search direction (e.g. x_bar - flow for Frank-Wolfe)
+    :param optimal: True for the system optimal objective
+    :param costFunction: scalar cost function, e.g. BPRcostFunction
+    :param tolerance: width of the step interval at which the search stops
+    :param maxIter: maximum number of derivative evaluations
+    :return: optimal step size
+    """
+    moving = direction != 0
+    if not moving.any():
+        return 0.0
+    flow = flow[moving]
+    direction = direction[moving]
+    links = LinkSubset(arrays, moving)
+
+    def derivative(step):
+        return float(np.dot(direction, link_costs(links, optimal, costFunction, flow=flow + step * direction)))
+
+    def second_derivative(step):
+        cost_derivatives = link_cost_derivatives(links, optimal, costFunction, flow=flow + step * direction)
+        if cost_derivatives is None:
+            return None
+        return float(np.dot(direction * direction, cost_derivatives))
+
+    low, high = 0.0, 1.0
+    g_low = derivative(low)
+    if g_low >= 0:
+        return low
+    g_high = derivative(high)
+    if g_high <= 0:
+        return high
+
+    step = low - g_low * (high - low) / (g_high - g_low)
+    for _ in range(maxIter):
+        g = derivative(step)
+        if g < 0:
+            low = step
+        elif g > 0:
+            high = step
+        else:
+            return step
+        if high - low < tolerance:
+            return (low + high) / 2
+
+        h = second_derivative(step)
+        if h is not None and h > 0:
+            newton_step = step - g / h
+            if low < newton_step < high:
+                if abs(newton_step - step) < tolerance:
+                    return newton_step
+                step = newton_step
+                continue
+        step = (low + high) / 2
+    return step
+
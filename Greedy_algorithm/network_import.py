@@ -1,3 +1,7 @@
+import hashlib
+import os
+import re
+
 import pandas as pd
 import numpy as np
 import openmatrix as omx
@@ -14,7 +18,8 @@ def import_network(
     ):
     """
     This method imports the network and the demand from the respective tntp files (see ttps://github.com/bstabler/TransportationNetworks)
-    After having imported them, it stores them in a quicker format in the same directory as the input files,
+    After having imported them, it stores them in a quicker format in the processed networks folder (a binary cache
+    keyed by the content of the files, see _cached_frame, and the processed csv files),
     if the method is called again it will automatically access the files already converted
 
     :param network_file: network (net) file name
@@ -32,33 +37,8 @@ def import_network(
     network_file_csv = PathUtils.processed_networks_folder / network_file_csv
     demand_file_csv = PathUtils.processed_networks_folder / demand_file_csv
 
-    if network_file_csv.is_file() and not force_reprocess:
-        net_df = pd.read_csv(str(network_file_csv),
-                             sep='\t')
-    else:
-        net_df = _net_file2df(network_file)
-        net_df.to_csv(path_or_buf=str(network_file_csv),
-                      sep='\t',
-                      index=False)
-
-    if demand_file_csv.is_file() and not force_reprocess:
-        demand_df = pd.read_csv(str(demand_file_csv),
-                                sep='\t')
-    else:
-        tripSet = _demand_file2trips(demand_file)
-        demand_df = pd.DataFrame(columns=["init_node", "term_node", "demand"])
-
-        k = 0
-        for orig in tripSet:
-            for dest in tripSet[orig]:
-                demand_df.loc[k] = [orig, dest, tripSet[orig][dest]]
-                k += 1
-
-        demand_df = demand_df.astype({"init_node": int, "term_node": int})
-
-        demand_df.to_csv(path_or_buf=str(demand_file_csv),
-                         sep='\t',
-                         index=False)
+    net_df = _cached_frame(network_file, network_file_csv, _net_file2df, force_reprocess)
+    demand_df = _cached_frame(demand_file, demand_file_csv, _demand_file2df, force_reprocess)
 
     UE_trips_df = None
     if UE_trip_times_file:
@@ -81,6 +61,47 @@ def import_network(
     return net_df, demand_df, UE_od_link_df, UE_trips_df
 
 
+# Version of the tntp parsers below, part of the key of the binary cache: increase it whenever the frames they
+# return change so that the networks cached by the previous version are processed again
+PARSER_VERSION = 1
+
+
+def _source_hash(source_file: str) -> str:
+    digest = hashlib.sha256(f"parser {PARSER_VERSION}\n".encode())
+    with open(source_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _cached_frame(source_file: str, csv_file, parse, force_reprocess: bool) -> pd.DataFrame:
+    """
+    Frame of a tntp file from the binary cache in the processed networks folder: a .npy record array named after the
+    file and the hash of its content and of PARSER_VERSION, loaded memory mapped. A changed source file or parser
+    gets a new name, so a stale cache is never read. On a miss the file is parsed, cached and also written as the
+    processed csv. Sources that are not tntp files (e.g. the csv files written by singleOD_optimization.prepare_network)
+    are read from the processed csv as before.
+    """
+    if not (source_file.endswith(".tntp") and os.path.isfile(source_file)):
+        if csv_file.is_file() and not force_reprocess:
+            return pd.read_csv(str(csv_file), sep='\t')
+        df = parse(source_file)
+    else:
+        cache_file = PathUtils.processed_networks_folder / f"{csv_file.stem}_{_source_hash(source_file)}.npy"
+        if cache_file.is_file() and not force_reprocess:
+            return pd.DataFrame(np.load(str(cache_file), mmap_mode='r'))
+        df = parse(source_file)
+        # text columns are stored as fixed width unicode, the cache must not need pickle
+        records = np.rec.fromarrays([df[c].to_numpy() if pd.api.types.is_numeric_dtype(df[c])
+                                     else df[c].to_numpy().astype(str) for c in df.columns],
+                                    names=list(df.columns))
+        np.save(str(cache_file), records)
+    df.to_csv(path_or_buf=str(csv_file),
+              sep='\t',
+              index=False)
+    return df
+
+
 def _net_file2df(network_file: str):
     net_df = pd.read_csv(network_file, skiprows=8, sep='\t')
 
@@ -90,48 +111,43 @@ def _net_file2df(network_file: str):
     net_df.drop(['~', ';'], axis=1, inplace=True)
     return net_df
 
-def _demand_file2trips(demand_file: str):
-
-    f = open(demand_file, 'r')
-    all_rows = f.read()
-    f.close()
-    blocks = all_rows.split('Origin')[1:]
-    tripSet = {}
-    for k in range(len(blocks)):
-        orig = blocks[k].split('\n')
-        dests = orig[1:]
-        orig = int(orig[0])
-        d = [eval('{' + a.replace(';', ',').replace(' ', '') + '}') for a in dests]
-        destinations = {}
-        for i in d:
-            destinations = {**destinations, **i}
-        tripSet[orig] = destinations
-
-    return tripSet
+def _demand_file2arrays(demand_file: str):
+    """
+    Parses a tntp trips file without eval: every "Origin" block is split into tokens
+    (destination : demand ; destination : demand ; ...) converted by numpy in one go.
+    Comment lines (starting with ~) are ignored.
+
+    :return: origin, destination (int arrays) and demand (float array) of every entry, in the order of the file
+    """
+    with open(demand_file, 'r') as f:
+        text = f.read()
+    text = re.sub(r'~[^\n]*', '', text)
+    origins, entries = [], []
+    for block in text.split('Origin')[1:]:
+        tokens = block.replace(':', ' ').replace(';', ' ').split()
+        values = np.array(tokens[1:], dtype=np.float64)
+        if len(values) % 2:
+            raise ValueError(f"Malformed trips block for origin {tokens[0]} in {demand_file}")
+        origins.append(np.full(len(values) // 2, int(tokens[0]), dtype=np.int64))
+        entries.append(values)
+    if not origins:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    entries = np.concatenate(entries).reshape(-1, 2)
+    return np.concatenate(origins), entries[:, 0].astype(np.int64), entries[:, 1]
+
+
+def _demand_file2df(demand_file: str):
+    orig, dest, demand = _demand_file2arrays(demand_file)
+    return pd.DataFrame({"init_node": orig, "term_node": dest, "demand": demand})
 
 def _demand_file2matrix(demand_file: str, omx_write_file_path: str = ""):  # Remember .omx
 
-    f = open(demand_file, 'r')
-    all_rows = f.read()
-    f.close()
-    blocks = all_rows.split('Origin')[1:]
-    matrix = {}
-    for k in range(len(blocks)):
-        orig = blocks[k].split('\n')
-        dests = orig[1:]
-        orig = int(orig[0])
-        d = [eval('{' + a.replace(';', ',').replace(' ', '') + '}') for a in dests]
-        destinations = {}
-        for i in d:
-            destinations = {**destinations, **i}
-        matrix[orig] = destinations
-    zones = max(matrix.keys())
+    orig, dest, demand = _demand_file2arrays(demand_file)
+    zones = int(max(orig.max(initial=0), dest.max(initial=0)))
 
+    # We map values to a index i-1, as Numpy is base 0
     mat = np.zeros((zones, zones))
-    for i in range(zones):
-        for j in range(zones):
-            # We map values to a index i-1, as Numpy is base 0
-            mat[i, j] = matrix.get(i + 1, {}).get(j + 1, 0)
+    mat[orig - 1, dest - 1] = demand
 
     if omx_write_file_path:
         index = np.arange(zones) + 1
@@ -146,4 +162,21 @@ def _read_UE_time(ue_file: str):
     '''
         for the CSO, reads the file with UE results and returns the dictionary od -> OD_time for User Equilibrium
     '''
-    
\ No newline at end of file
+    
+def read_link_flows(flow_file: str) -> dict:
+    '''
+        reads the link flows of an assignment result (the files written by writeResults, e.g. *_flow.tntp)
+        or of a TNTP flow file (From, To, Volume, Cost columns) and returns the dictionary (init_node, term_node) -> flow
+    '''
+    flows = {}
+    with open(flow_file, 'r') as f:
+        in_table = False
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if not in_table:
+                in_table = fields[0].lower() in ('init_node', 'from')
+                continue
+            flows[fields[0], fields[1]] = float(fields[2])
+    return flows
@@ -0,0 +1,185 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+class ODLinkFlows:
+    """
+    Sparse store of the link flows of every OD pair, replacing one Link object per (link, OD) combination.
+    The flows are kept in a CSR matrix (rows: OD index, columns: link index) holding only the non-zero entries.
+    """
+
+    collects_trees = False
+
+    def __init__(self, numODs: int, numLinks: int):
+        self.numODs = numODs
+        self.numLinks = numLinks
+        self.flows = sp.csr_matrix((numODs, numLinks))
+
+    def aon(self, x_bar_od) -> sp.csr_matrix:
+        """
+        Builds the sparse matrix of an all-or-nothing loading given as (od indices, link indices, flows)
+        """
+        od, link, flow = x_bar_od
+        aon = sp.csr_matrix((flow, (od, link)), shape=(self.numODs, self.numLinks))
+        aon.sum_duplicates()
+        return aon
+
+    def combine(self, coefficients: list, states: list) -> sp.csr_matrix:
+        """
+        Linear combination of OD flow states (e.g. all-or-nothing loadings), used for the conjugate directions
+        """
+        combination = sp.csr_matrix((self.numODs, self.numLinks))
+        for coefficient, state in zip(coefficients, states):
+            if coefficient != 0:
+                combination = combination + coefficient * state
+        return combination.tocsr()
+
+    def step(self, alpha: float, target: sp.csr_matrix):
+        """
+        Moves the OD flows towards the target state: flows = alpha * target + (1 - alpha) * flows
+        """
+        self.flows = (alpha * target + (1 - alpha) * self.flows).tocsr()
+        self.flows.eliminate_zeros()
+        self.flows.sort_indices()
+
+    def update(self, alpha: float, x_bar_od):
+        """
+        Moves the OD flows towards the all-or-nothing loading: flows = alpha * x_bar_od + (1 - alpha) * flows
+        """
+        self.step(alpha, self.aon(x_bar_od))
+
+    def od_flows(self, od: int):
+        """
+        Returns the link indices (ascending) and the flows on them for the OD with index od
+        """
+        start, end = self.flows.indptr[od], self.flows.indptr[od + 1]
+        return self.flows.indices[start:end], self.flows.data[start:end]
+
+    def link_flows(self) -> np.ndarray:
+        """
+        Returns the total link flows (sum over the OD pairs)
+        """
+        return np.asarray(self.flows.sum(axis=0)).ravel()
+
+    def reset(self):
+        self.flows = sp.csr_matrix((self.numODs, self.numLinks))
+
+
+class OriginTreeFlows:
+    """
+    Origin based store of the OD link flows. Every all-or-nothing loading is a set of shortest path trees
+    (one per origin), each tree is stored once (identical trees found in later iterations are reused) together
+    with its weight in the current solution. The link flows of an OD pair are reconstructed only when requested,
+    so memory and update cost depend on the number of origins instead of the number of OD pairs.
+    """
+
+    collects_trees = True
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.numODs = len(arrays.odKeys)
+        self.numLinks = arrays.numLinks
+
+        self.odOrigin = np.full(self.numODs, -1, dtype=np.int64)  # od index -> origin position in arrays.origins
+        for k in range(len(arrays.origins)):
+            self.odOrigin[arrays.origin_ods[arrays.origin_ptr[k]:arrays.origin_ptr[k + 1]]] = k
+        self.reset()
+
+    def reset(self):
+        self.trees = []  # tree id -> predecessor link of every node
+        self.treeIndex = {}  # (origin position, tree bytes) -> tree id
+        self.originTrees = [[] for _ in range(len(self.arrays.origins))]  # origin position -> tree ids
+        self.weights = np.zeros(0)  # tree id -> weight in the current solution
+
+    def register(self, origin: int, tree: np.ndarray) -> int:
+        """
+        Returns the id of the shortest path tree of the origin (position in arrays.origins), storing it if new
+        """
+        key = (origin, tree.tobytes())
+        treeId = self.treeIndex.get(key)
+        if treeId is None:
+            treeId = len(self.trees)
+            self.treeIndex[key] = treeId
+            self.trees.append(tree.copy())
+            self.originTrees[origin].append(treeId)
+        return treeId
+
+    def aon(self, trees: np.ndarray) -> np.ndarray:
+        """
+        Returns the weights (over the stored trees) of an all-or-nothing loading given as one tree per origin
+        """
+        treeIds = [self.register(k, tree) for k, tree in enumerate(trees)]
+        weights = np.zeros(len(self.trees))
+        weights[treeIds] = 1.0
+        return weights
+
+    def _padded(self, weights: np.ndarray) -> np.ndarray:
+        # weights over the trees stored so far, trees registered after the weights were computed get 0
+        padded = np.zeros(len(self.trees))
+        padded[:len(weights)] = weights
+        return padded
+
+    def combine(self, coefficients: list, states: list) -> np.ndarray:
+        """
+        Linear combination of tree weights (e.g. all-or-nothing loadings), used for the conjugate directions
+        """
+        combination = np.zeros(len(self.trees))
+        for coefficient, state in zip(coefficients, states):
+            combination += coefficient * self._padded(state)
+        return combination
+
+    def step(self, alpha: float, target: np.ndarray):
+        """
+        Moves the OD flows towards the target weights: weights = alpha * target + (1 - alpha) * weights
+        """
+        self.weights = alpha * self._padded(target) + (1 - alpha) * self._padded(self.weights)
+
+    def update(self, alpha: float, x_bar_od: np.ndarray):
+        """
+        Moves the OD flows towards the all-or-nothing loading: weights = alpha * x_bar_od + (1 - alpha) * weights
+        """
+        self.step(alpha, self.aon(x_bar_od))
+
+    def od_flows(self, od: int):
+        """
+        Returns the link indices (ascending) and the flows on them for the OD with index od
+        """
+        origin = self.odOrigin[od]
+        dest = self.arrays.od_dest[od]
+        demand = self.arrays.od_demand[od]
+        if origin == -1 or demand <= 0 or self.arrays.origins[origin] == dest:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        links = []
+        flows = []
+        for treeId in self.originTrees[origin]:
+            if treeId >= len(self.weights) or self.weights[treeId] <= 0:
+                continue
+            path = self.arrays.shortestPaths.path(dest, self.trees[treeId])
+            links.extend(path)
+            flows.extend([self.weights[treeId] * demand] * len(path))
+        odFlow = np.bincount(links, weights=flows, minlength=self.numLinks) if links else np.zeros(self.numLinks)
+        odLinks = np.flatnonzero(odFlow)
+        return odLinks, odFlow[odLinks]
+
+    def link_flows(self) -> np.ndarray:
+        """
+        Returns the total link flows (sum over the OD pairs)
+        """
+        flows = np.zeros(self.numLinks)
+        for od in range(self.numODs):
+            odLinks, odFlows = self.od_flows(od)
+            flows[odLinks] += odFlows
+        return flows
+
+
+def create_od_flows(mode: str, arrays):
+    """
+    Creates the store of the OD link flows:
+        - "link": sparse OD x link matrix updated at every iteration (ODLinkFlows)
+        - "origin": shortest path trees per origin, OD flows reconstructed on request (OriginTreeFlows)
+    """
+    if mode == "link":
+        return ODLinkFlows(len(arrays.odKeys), arrays.numLinks)
+    if mode == "origin":
+        return OriginTreeFlows(arrays)
+    raise ValueError(f'OD flow mode must be "link" or "origin", got {mode}')
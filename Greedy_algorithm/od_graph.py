@@ -0,0 +1,173 @@
+import heapq
+import itertools
+
+import numpy as np
+
+
+class ODGraph:
+    """
+    Flow graph of a single OD pair on integer arrays: the node ids and, for every link, the tail and head node index,
+    the flow of the OD pair and the travel time (see build_od_graphs for the numbering of the nodes and links).
+    """
+
+    def __init__(self, nodes: np.ndarray, tail: np.ndarray, head: np.ndarray, flow: np.ndarray, time: np.ndarray):
+        self.nodes = nodes  # node index -> node id
+        self.tail = tail
+        self.head = head
+        self.flow = flow
+        self.time = time
+        self._index = None
+
+    @classmethod
+    def from_links(cls, init_node, term_node, flow, time):
+        """
+        Graph of the links given by their tail and head node ids
+        """
+        return build_od_graphs([0, len(init_node)], init_node, term_node, flow, time)[0]
+
+    @property
+    def index(self) -> dict:
+        """
+        node id -> node index
+        """
+        if self._index is None:
+            self._index = {node: i for i, node in enumerate(self.nodes.tolist())}
+        return self._index
+
+    def __contains__(self, node) -> bool:
+        return int(node) in self.index
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def edges(self, data: bool = False) -> list:
+        nodes = self.nodes.tolist()
+        edges = [(nodes[u], nodes[v]) for u, v in zip(self.tail.tolist(), self.head.tolist())]
+        if not data:
+            return edges
+        return [(u, v, {'flow': flow, 'time': time})
+                for (u, v), flow, time in zip(edges, self.flow.tolist(), self.time.tolist())]
+
+    def decompose(self, origin: int, destination: int) -> list:
+        """
+        Splits the flow from origin to destination (node ids) into routes: the fastest route over the links still
+        carrying flow takes the smallest flow along it, which is subtracted from its links, and links left without
+        flow are dropped, until the destination is no longer reachable. The graph itself is left unchanged.
+        The fastest routes are found as nx.dijkstra_path does (a label only improves on a strictly shorter distance,
+        equal labels leave the heap in push order, links are scanned in networkx order), so that ties between equally
+        fast routes give the same routes as the networkx decomposition.
+
+        :return: (time, flow, node ids) of the routes with flow, in the order they are found
+        """
+        o, d = self.index[int(origin)], self.index[int(destination)]
+        nodes = self.nodes.tolist()
+        flow = self.flow.tolist()
+        time = self.time.tolist()
+        tails, heads = self.tail.tolist(), self.head.tolist()
+        adjacency = [[] for _ in nodes]  # node index -> (link, head) of its links
+        for link, (tail, head) in enumerate(zip(tails, heads)):
+            adjacency[tail].append((link, head))
+        dropped = [False] * len(flow)
+        routes = []
+        while True:
+            pred = self._dijkstra(o, d, adjacency, time, dropped)
+            if d not in pred:
+                break
+            links = []
+            node = d
+            while node != o:
+                links.append(pred[node])
+                node = tails[pred[node]]
+            links.reverse()
+            minFlow = min(flow[link] for link in links)
+            routeTime = 0
+            for link in links:
+                flow[link] -= minFlow
+                routeTime += time[link]
+                if flow[link] == 0:
+                    dropped[link] = True
+            if minFlow != 0:
+                routes.append((routeTime, minFlow, [nodes[o]] + [nodes[heads[link]] for link in links]))
+        return routes
+
+    @staticmethod
+    def _dijkstra(o: int, d: int, adjacency: list, time: list, dropped: list) -> dict:
+        """
+        node index -> link it is reached by, on the fastest route from o, for the nodes labelled before d is reached
+        """
+        dist = {}
+        seen = {o: 0}
+        pred = {o: -1}
+        counter = itertools.count()
+        fringe = [(0, next(counter), o)]
+        while fringe:
+            label, _, node = heapq.heappop(fringe)
+            if node in dist:
+                continue
+            dist[node] = label
+            if node == d:
+                break
+            for link, head in adjacency[node]:
+                if dropped[link] or head in dist:
+                    continue
+                newLabel = label + time[link]
+                if head not in seen or newLabel < seen[head]:
+                    seen[head] = newLabel
+                    pred[head] = link
+                    heapq.heappush(fringe, (newLabel, next(counter), head))
+        if d not in dist:
+            pred.pop(d, None)
+        return pred
+
+
+def build_od_graphs(od_ptr, init_node, term_node, flow, time) -> list:
+    """
+    Builds the graphs of many OD pairs at once, the links of the OD pair i are init_node[od_ptr[i]:od_ptr[i + 1]]
+    (tail node ids), term_node (head node ids), flow and time over the same range.
+    In every graph the nodes are numbered in order of first appearance and the links are grouped by tail node, the
+    order in which networkx iterates the same edges, so that ties between equally fast routes are broken the same
+    way. A link given twice keeps its first position and its last flow and time.
+    """
+    od_ptr = np.asarray(od_ptr, dtype=np.int64)
+    init_node = np.asarray(init_node, dtype=np.int64)
+    term_node = np.asarray(term_node, dtype=np.int64)
+    flow = np.asarray(flow, dtype=np.float64)
+    time = np.asarray(time, dtype=np.float64)
+    numODs = len(od_ptr) - 1
+    od = np.repeat(np.arange(numODs), np.diff(od_ptr))
+
+    # number the nodes of every OD pair in order of first appearance (tail then head of every link)
+    ends = np.column_stack((init_node, term_node)).ravel()
+    ids, code = np.unique(ends, return_inverse=True)
+    keys, first, inverse = np.unique(np.repeat(od, 2) * len(ids) + code.ravel(), return_index=True,
+                                     return_inverse=True)
+    keyOD = keys // len(ids)
+    order = np.lexsort((first, keyOD))
+    nodeStart = np.searchsorted(keyOD[order], np.arange(numODs + 1))
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys)) - nodeStart[keyOD[order]]
+    index = rank[inverse.ravel()]
+    tail, head = index[0::2], index[1::2]
+    nodes = ids[keys[order] % len(ids)]
+
+    # repeated links keep the first position and the last data, then the links are grouped by tail node
+    position = np.arange(len(od))
+    sortedLinks = np.lexsort((position, head, tail, od))
+    new = np.ones(len(sortedLinks) + 1, dtype=bool)  # new[i]: link i of sortedLinks starts a group of repeats
+    new[1:-1] = (od[sortedLinks][1:] != od[sortedLinks][:-1]) | (tail[sortedLinks][1:] != tail[sortedLinks][:-1]) \
+        | (head[sortedLinks][1:] != head[sortedLinks][:-1])
+    links = sortedLinks[new[:-1]]
+    dataLinks = sortedLinks[new[1:]]
+    grouped = np.lexsort((links, tail[links], od[links]))
+    links, dataLinks = links[grouped], dataLinks[grouped]
+    linkStart = np.searchsorted(od[links], np.arange(numODs + 1))
+
+    tail, head, flow, time = tail[links], head[links], flow[dataLinks], time[dataLinks]
+    nodeStart = nodeStart.tolist()
+    linkStart = linkStart.tolist()
+    graphs = []
+    for i in range(numODs):
+        start, end = linkStart[i], linkStart[i + 1]
+        graphs.append(ODGraph(nodes[nodeStart[i]:nodeStart[i + 1]], tail[start:end], head[start:end],
+                              flow[start:end], time[start:end]))
+    return graphs
@@ -0,0 +1,195 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+
+from utils import ROUND, OD_pair
+from cost_kernels import link_costs
+from od_graph import build_od_graphs
+
+
+class ODResults:
+    """
+    Link flows of every OD pair of an assignment in columnar form, the binary counterpart of the *_OD_pairs.txt files
+    written by writeResults. The entries of the OD pair i are entry_link[od_ptr[i]:od_ptr[i + 1]] (positions in the
+    link table) with the flows entry_flow[od_ptr[i]:od_ptr[i + 1]]. The link table holds the node ids of every link
+    and its travel time at the total link flows.
+    """
+
+    FIELDS = ("origin", "destination", "demand", "od_ptr", "entry_link", "entry_flow",
+              "init_node", "term_node", "link_time")
+
+    def __init__(self, origin, destination, demand, od_ptr, entry_link, entry_flow, init_node, term_node, link_time):
+        self.origin = np.asarray(origin, dtype=np.int64)  # origin id of every OD pair
+        self.destination = np.asarray(destination, dtype=np.int64)  # destination id of every OD pair
+        self.demand = np.asarray(demand, dtype=np.float64)
+        self.od_ptr = np.asarray(od_ptr, dtype=np.int64)
+        self.entry_link = np.asarray(entry_link, dtype=np.int64)
+        self.entry_flow = np.asarray(entry_flow, dtype=np.float64)
+        self.init_node = np.asarray(init_node, dtype=np.int64)  # node ids of every link
+        self.term_node = np.asarray(term_node, dtype=np.int64)
+        self.link_time = np.asarray(link_time, dtype=np.float64)
+
+    @classmethod
+    def from_network(cls, network, costFunction, odPairs: list = None):
+        """
+        Results of the last assignment of the network, for the given (origin, destination) pairs or all the OD pairs
+        """
+        arrays = network.compile()
+        nodeIds = np.array(arrays.nodeIds, dtype=np.int64)
+        if odPairs is None:
+            odPairs = network.tripSet
+        odKeys = [(str(o), str(d)) for o, d in odPairs]
+        links, flows = [], []
+        for odKey in odKeys:
+            odLinks, odFlows = network.odFlows.od_flows(arrays.odIndex[odKey])
+            links.append(odLinks)
+            flows.append(odFlows)
+        od_ptr = np.zeros(len(odKeys) + 1, dtype=np.int64)
+        np.cumsum([len(odLinks) for odLinks in links], out=od_ptr[1:])
+        return cls(origin=[int(o) for o, _ in odKeys],
+                   destination=[int(d) for _, d in odKeys],
+                   demand=[network.tripSet[odKey].demand for odKey in odKeys],
+                   od_ptr=od_ptr,
+                   entry_link=np.concatenate(links) if links else np.zeros(0, dtype=np.int64),
+                   entry_flow=np.concatenate(flows) if flows else np.zeros(0),
+                   init_node=nodeIds[arrays.init_node],
+                   term_node=nodeIds[arrays.term_node],
+                   link_time=link_costs(arrays, False, costFunction, capacity=arrays.max_capacity))
+
+    def save(self, file: str, compressed: bool = False):
+        save = np.savez_compressed if compressed else np.savez
+        save(file, **{field: getattr(self, field) for field in self.FIELDS})
+
+    def text_blocks(self):
+        """
+        Yields the *_OD_pairs.txt file written by writeResults as strings, the header and then one block per OD pair
+        (the OD pair line, the lines of the links it uses and a blank line)
+        """
+        yield "OD PAIRS\ninit_node\tterm_node\tdemand\ninit_node\tterm_node\tflow\ttravelTimeOnLink\n"
+        # the text of every link around its flow is formatted once
+        linkHead = [f"{i}\t{j}\t" for i, j in zip(self.init_node.tolist(), self.term_node.tolist())]
+        linkTail = [f"\t{t}\n" for t in self.link_time.tolist()]
+        od_ptr = self.od_ptr.tolist()
+        entry_link = self.entry_link.tolist()
+        entry_flow = self.entry_flow.tolist()
+        for od, (origin, destination, demand) in enumerate(zip(self.origin.tolist(), self.destination.tolist(),
+                                                               self.demand.tolist())):
+            start, end = od_ptr[od], od_ptr[od + 1]
+            yield "".join([f"{origin}\t{destination}\t{demand}\n"]
+                          + [linkHead[link] + str(flow) + linkTail[link]
+                             for link, flow in zip(entry_link[start:end], entry_flow[start:end])]
+                          + ["\n"])
+
+    def write_text(self, file: str, compressed: bool = None, chunkSize: int = 1 << 20):
+        """
+        Writes the *_OD_pairs.txt file in chunks of about chunkSize characters, gzip compressed if compressed is True
+        (by default when the file name ends with .gz)
+        """
+        if compressed is None:
+            compressed = str(file).endswith(".gz")
+        chunk, size = [], 0
+        with (gzip.open(file, "wt") if compressed else open(file, "w")) as outFile:
+            for block in self.text_blocks():
+                chunk.append(block)
+                size += len(block)
+                if size >= chunkSize:
+                    outFile.write("".join(chunk))
+                    chunk, size = [], 0
+            outFile.write("".join(chunk))
+
+    @classmethod
+    def load(cls, file: str):
+        """
+        Reads the results from a .npz file written by save or from an *_OD_pairs.txt file (or .txt.gz) written by
+        writeResults
+        """
+        if str(file).endswith(".npz"):
+            with np.load(file) as data:
+                return cls(**{field: data[field] for field in cls.FIELDS})
+        return cls._read_text(file)
+
+    @classmethod
+    def _read_text(cls, file: str):
+        origin, destination, demand, sizes = [], [], [], []
+        linkIndex = {}
+        init_node, term_node, link_time = [], [], []
+        entry_link, entry_flow = [], []
+        with (gzip.open(file, 'rt') if str(file).endswith(".gz") else open(file, 'r')) as f:
+            # skip the header
+            lines = f.readlines()[3:]
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 3:
+                origin.append(int(fields[0]))
+                destination.append(int(fields[1]))
+                demand.append(float(fields[2]))
+                sizes.append(0)
+            elif len(fields) == 4:
+                key = (fields[0], fields[1])
+                link = linkIndex.get(key)
+                if link is None:
+                    link = linkIndex[key] = len(init_node)
+                    init_node.append(int(fields[0]))
+                    term_node.append(int(fields[1]))
+                    link_time.append(float(fields[3]))
+                entry_link.append(link)
+                entry_flow.append(float(fields[2]))
+                sizes[-1] += 1
+        od_ptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=od_ptr[1:])
+        return cls(origin, destination, demand, od_ptr, entry_link, entry_flow, init_node, term_node, link_time)
+
+    @property
+    def entry_od(self) -> np.ndarray:
+        """
+        OD pair (position) of every entry
+        """
+        return np.repeat(np.arange(len(self.origin)), np.diff(self.od_ptr))
+
+    def records(self) -> pd.DataFrame:
+        """
+        One row per (OD pair, link) entry with the columns origin, destination, link_origin, link_destination,
+        time and flow, the ids as strings like when the text file is split
+        """
+        od = self.entry_od
+        return pd.DataFrame({"origin": self.origin.astype(str)[od],
+                             "destination": self.destination.astype(str)[od],
+                             "link_origin": self.init_node.astype(str)[self.entry_link],
+                             "link_destination": self.term_node.astype(str)[self.entry_link],
+                             "time": self.link_time[self.entry_link],
+                             "flow": self.entry_flow})
+
+    def noise_flow(self, selected_OD: tuple) -> pd.DataFrame:
+        """
+        Flow of all the OD pairs but the selected one on every link used by them,
+        columns init_node, term_node (ints) and noise_flow, sorted like singleOD_optimization.get_noise_flow
+        """
+        keep = ~((self.origin == int(selected_OD[0])) & (self.destination == int(selected_OD[1])))[self.entry_od]
+        links = self.entry_link[keep]
+        noise = np.bincount(links, weights=self.entry_flow[keep], minlength=len(self.init_node))
+        used = np.unique(links)
+        df = pd.DataFrame({"init_node": self.init_node[used], "term_node": self.term_node[used],
+                           "noise_flow": noise[used]})
+        # the text ids are grouped as strings
+        order = np.lexsort((df["term_node"].astype(str).to_numpy(), df["init_node"].astype(str).to_numpy()))
+        return df.iloc[order].reset_index(drop=True)
+
+    def pairs(self, precision: int = ROUND) -> list:
+        """
+        OD pairs with demand and the graph of their link flows and times rounded to precision (see od_graph.ODGraph),
+        as dijkstra_routes.read_input builds them from the text file
+        """
+        times = np.array([round(t, precision) for t in self.link_time.tolist()])
+        flows = np.array([round(f, precision) for f in self.entry_flow.tolist()])
+        graphs = build_od_graphs(self.od_ptr, self.init_node[self.entry_link], self.term_node[self.entry_link],
+                                 flows, times[self.entry_link])
+        pairs = []
+        for origin, destination, demand, graph in zip(self.origin.tolist(), self.destination.tolist(),
+                                                      self.demand.tolist(), graphs):
+            if demand <= 0:
+                continue
+            pair = OD_pair(origin, destination, demand)
+            pair.add_graph(graph)
+            pairs.append(pair)
+        return pairs
@@ -0,0 +1,125 @@
+import os
+import json
+from multiprocessing import Pool
+
+import numpy as np
+
+from utils import OD_pair, Route
+from greedy import prep_data, run_simulation
+from analytical import analytical_pair
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(v) for key, v in value.items()}
+    return value
+
+
+def _task(pair: OD_pair):
+    # only the routes are sent to the workers, not the graph of the pair
+    return pair.origin, pair.destination, pair.flow, [(route.time, route.flow, route.id) for route in pair.routes]
+
+
+def _pair(task) -> OD_pair:
+    origin, destination, flow, routes = task
+    pair = OD_pair(origin, destination, flow)
+    pair.set_routes([Route(time, routeFlow, id) for time, routeFlow, id in routes])
+    return pair
+
+
+def _simulate(args):
+    task, kwargs = args
+    origin, destination, _, routes = task
+    agents, route_data = prep_data([Route(time, flow, id) for time, flow, id in routes])
+    result = {"origin": origin, "destination": destination, "agents": agents}
+    if agents > 0:
+        result.update(run_simulation(agents, route_data, **kwargs))
+    return _jsonable(result)
+
+
+def _analytical(args):
+    task, _ = args
+    return _jsonable(analytical_pair(_pair(task)))
+
+
+def _read_results(results_file: str) -> dict:
+    """
+    (origin, destination) -> result of the lines of a results file, a last line cut by a crash is ignored
+    """
+    done = {}
+    if results_file is None or not os.path.isfile(results_file):
+        return done
+    with open(results_file, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[result["origin"], result["destination"]] = result
+    return done
+
+
+def map_pairs(function, pairs: list, results_file: str = None, workers: int = None, chunksize: int = 4,
+              resume: bool = True, kwargs: dict = None) -> list:
+    """
+    Applies function (_simulate or _analytical) to the OD pairs on a pool of worker processes, the pairs are sent in
+    chunks of chunksize. Every result is appended to results_file (one json line per OD pair) as soon as it is back,
+    with resume the pairs already in the file are not computed again.
+
+    :return: the results in the order of the pairs
+    """
+    done = _read_results(results_file) if resume else {}
+    tasks = [(_task(pair), kwargs or {}) for pair in pairs if (pair.origin, pair.destination) not in done]
+    out = None
+    try:
+        if results_file is not None:
+            if not resume and os.path.isfile(results_file):
+                os.remove(results_file)
+            out = open(results_file, "a")
+            if out.tell() > 0:
+                # start on a new line after a line cut by a crash
+                with open(results_file, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        out.write("\n")
+        if tasks:
+            with Pool(workers or os.cpu_count()) as pool:
+                # imap keeps the order of the pairs, the results of a chunk are written as they come
+                for result in pool.imap(function, tasks, chunksize=chunksize):
+                    done[result["origin"], result["destination"]] = result
+                    if out is not None:
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+    finally:
+        if out is not None:
+            out.close()
+    return [done[pair.origin, pair.destination] for pair in pairs]
+
+
+def simulate_pairs(pairs: list, results_file: str = None, workers: int = None, chunksize: int = 4,
+                   resume: bool = True, **kwargs) -> list:
+    """
+    Greedy simulation (greedy.run_simulation) of every OD pair from its routes, on a pool of worker processes.
+    Pairs with many agents gain the most from running on their own core, many small pairs are better simulated
+    together with greedy.run_simulations.
+
+    :param kwargs: passed to run_simulation (thresholds, max_steps, eps, history_mode, stop_on_cycle, ...)
+    :return: for every pair (in order) the results of run_simulation with its origin, destination and agents
+    """
+    return map_pairs(_simulate, pairs, results_file, workers, chunksize, resume, kwargs)
+
+
+def analytical_pairs(pairs: list, results_file: str = None, workers: int = None, chunksize: int = 16,
+                     resume: bool = True) -> list:
+    """
+    Analytical cycle of every OD pair (analytical.analytical_pair) on a pool of worker processes
+
+    :return: the results in the order of the pairs, as analytical.analytical_simulation
+    """
+    return map_pairs(_analytical, pairs, results_file, workers, chunksize, resume)
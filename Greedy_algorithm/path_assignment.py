@@ -0,0 +1,203 @@
+import numpy as np
+
+from cost_kernels import link_costs, link_cost_derivatives, refresh_links
+from utils import OD_pair, Route
+
+
+class PathFlows:
+    """
+    Path based assignment by gradient projection (Jayakrishnan et al., 1994).
+    Every OD pair keeps an explicit set of paths (link indices from origin to destination) with their flows.
+    A sweep visits the origins one by one: the shortest paths of the origin are added to the path sets and,
+    for every OD pair, flow is shifted from the longer paths to the shortest one by a Newton step
+    (cost difference divided by the sum of the cost derivatives of the links not shared by the two paths).
+    The costs of the links touched by an OD pair are updated before the next OD pair is equilibrated.
+    """
+
+    def __init__(self, arrays, optimal: bool, costFunction):
+        self.arrays = arrays
+        self.optimal = optimal
+        self.costFunction = costFunction
+        numODs = len(arrays.odKeys)
+        self.paths = [[] for _ in range(numODs)]  # od index -> link index arrays of the paths
+        self.pathIndex = [{} for _ in range(numODs)]  # od index -> {tuple of link indices: position in paths}
+        self.flows = [[] for _ in range(numODs)]  # od index -> flows of the paths
+        self.derivative = np.zeros(arrays.numLinks)
+
+    def _add_path(self, od: int, links: list) -> int:
+        key = tuple(links)
+        position = self.pathIndex[od].get(key)
+        if position is None:
+            position = len(self.paths[od])
+            self.pathIndex[od][key] = position
+            self.paths[od].append(np.array(links, dtype=np.int64))
+            self.flows[od].append(0.0)
+        return position
+
+    def _equilibrate(self, od: int, shortest: int):
+        arrays = self.arrays
+        paths = self.paths[od]
+        flows = self.flows[od]
+        spLinks = paths[shortest]
+        if len(paths) == 1:
+            if flows[0] == 0:
+                flows[0] = float(arrays.od_demand[od])
+                arrays.flow[spLinks] += flows[0]
+                refresh_links(arrays, spLinks, self.optimal, self.costFunction, self.derivative)
+            return
+
+        cost = arrays.cost
+        spCost = cost[spLinks].sum()
+        changed = [spLinks]
+        for i, links in enumerate(paths):
+            if i == shortest or flows[i] <= 0:
+                continue
+            difference = cost[links].sum() - spCost
+            if difference <= 0:
+                continue
+            denominator = self.derivative[np.setxor1d(links, spLinks)].sum()
+            shift = flows[i] if denominator <= 0 else min(flows[i], difference / denominator)
+            flows[i] -= shift
+            flows[shortest] += shift
+            arrays.flow[links] -= shift
+            arrays.flow[spLinks] += shift
+            changed.append(links)
+
+        # drop the paths without flow
+        if any(f <= 0 for f in flows):
+            kept = [i for i, f in enumerate(flows) if f > 0]
+            self.paths[od] = [paths[i] for i in kept]
+            self.flows[od] = [flows[i] for i in kept]
+            self.pathIndex[od] = {tuple(links.tolist()): i for i, links in enumerate(self.paths[od])}
+        if len(changed) > 1:
+            refresh_links(arrays, np.unique(np.concatenate(changed)), self.optimal, self.costFunction,
+                          self.derivative)
+
+    def sweep(self):
+        """
+        One gradient projection iteration over all the origins, arrays.flow and arrays.cost are updated in place
+        """
+        arrays = self.arrays
+        shortestPaths = arrays.shortestPaths
+        od_dest = arrays.od_dest.tolist()
+        od_demand = arrays.od_demand.tolist()
+        origin_ptr = arrays.origin_ptr.tolist()
+        origin_ods = arrays.origin_ods.tolist()
+        derivative = link_cost_derivatives(arrays, self.optimal, self.costFunction)
+        self.derivative[:] = 0.0 if derivative is None else derivative
+
+        for k, r in enumerate(arrays.origins.tolist()):
+            ods = [od for od in origin_ods[origin_ptr[k]:origin_ptr[k + 1]] if od_demand[od] > 0 and od_dest[od] != r]
+            if not ods:
+                continue
+            shortestPaths.run(r, arrays.cost.tolist(), targets=[od_dest[od] for od in ods])
+            spLinks = {od: shortestPaths.path(od_dest[od])[::-1] for od in ods}
+            for od in ods:
+                self._equilibrate(od, self._add_path(od, spLinks[od]))
+
+    def _decompose(self, origin: int, dest: int, residual: dict, tolerance: float) -> dict:
+        """
+        Splits the flow of an OD pair (link index -> flow, consumed) into paths by following the largest outgoing flow,
+        flow around cycles and flow stuck at dead ends is dropped
+        """
+        adjacency = self.arrays.shortestPaths.adjacency
+        pathFlows = {}
+        while True:
+            nodes = [origin]
+            position = {origin: 0}
+            pathLinks = []
+            node = origin
+            while node != dest:
+                flow, link, head = max(((residual.get(link, 0.0), link, head) for link, head in adjacency[node]),
+                                       default=(0.0, -1, -1))
+                if flow <= tolerance:
+                    break
+                if head in position:
+                    # drop the flow around the cycle and continue from its first node
+                    cycle = pathLinks[position[head]:] + [link]
+                    cycleFlow = min(residual[l] for l in cycle)
+                    for l in cycle:
+                        residual[l] -= cycleFlow
+                    for n in nodes[position[head] + 1:]:
+                        del position[n]
+                    del nodes[position[head] + 1:]
+                    del pathLinks[position[head]:]
+                    node = head
+                    continue
+                pathLinks.append(link)
+                position[head] = len(nodes)
+                nodes.append(head)
+                node = head
+            if node != dest:
+                if not pathLinks:
+                    return pathFlows
+                # dead end, drop the flow of the last link
+                residual[pathLinks[-1]] = 0.0
+                continue
+            flow = min(residual[link] for link in pathLinks)
+            for link in pathLinks:
+                residual[link] -= flow
+            key = tuple(pathLinks)
+            pathFlows[key] = pathFlows.get(key, 0.0) + flow
+
+    def load(self, odLinkFlows: tuple, tolerance: float = 1e-9):
+        """
+        Warm start from the link flows of the OD pairs given as (od indices, link indices, flows): the flows of every
+        OD pair are split into paths, scaled to its demand, and arrays.flow is rebuilt from the paths
+        """
+        arrays = self.arrays
+        residuals = {}
+        for od, link, flow in zip(*(column.tolist() for column in odLinkFlows)):
+            if flow > 0:
+                odResidual = residuals.setdefault(od, {})
+                odResidual[link] = odResidual.get(link, 0.0) + flow
+        for od, residual in residuals.items():
+            origin, dest, demand = int(arrays.od_orig[od]), int(arrays.od_dest[od]), float(arrays.od_demand[od])
+            if demand <= 0 or origin == dest:
+                continue
+            pathFlows = self._decompose(origin, dest, residual, tolerance * demand)
+            total = sum(pathFlows.values())
+            for path, flow in pathFlows.items():
+                self.flows[od][self._add_path(od, list(path))] = flow * demand / total
+
+        arrays.flow[:] = 0.0
+        for paths, flows in zip(self.paths, self.flows):
+            for path, flow in zip(paths, flows):
+                arrays.flow[path] += flow
+
+    def od_link_flows(self) -> tuple:
+        """
+        Returns the link flows of the OD pairs as (od indices, link indices, flows)
+        """
+        ods, links, flows = [], [], []
+        for od, (paths, pathFlows) in enumerate(zip(self.paths, self.flows)):
+            for path, flow in zip(paths, pathFlows):
+                ods.extend([od] * len(path))
+                links.extend(path.tolist())
+                flows.extend([flow] * len(path))
+        return np.array(ods, dtype=np.int64), np.array(links, dtype=np.int64), np.array(flows)
+
+    def routes(self, minFlow: float = 0.0) -> list:
+        """
+        Returns an OD_pair with its routes (fastest first) for every OD pair with demand, the route times are the
+        travel times (not the marginal costs) of the current flows, the paths are lists of node ids
+        """
+        arrays = self.arrays
+        times = link_costs(arrays, False, self.costFunction, capacity=arrays.max_capacity)
+        nodeIds = arrays.nodeIds
+        init_node = arrays.init_node
+        term_node = arrays.term_node
+        pairs = []
+        for od, (r, s) in enumerate(arrays.odKeys):
+            demand = float(arrays.od_demand[od])
+            if demand <= 0 or r == s:
+                continue
+            pair = OD_pair(r, s, demand)
+            routes = sorted(((float(times[path].sum()), flow, path)
+                             for path, flow in zip(self.paths[od], self.flows[od]) if flow > minFlow),
+                            key=lambda route: route[0])
+            for routeTime, flow, path in routes:
+                nodes = [int(nodeIds[init_node[path[0]]])] + [int(nodeIds[n]) for n in term_node[path].tolist()]
+                pair.add_routes(Route(routeTime, float(flow), pair.get_num_routes(), nodes))
+            pairs.append(pair)
+        return pairs
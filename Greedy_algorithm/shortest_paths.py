@@ -0,0 +1,130 @@
+import heapq
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+
+
+class ShortestPaths:
+    """
+    Shortest path engine on a directed graph given by the tail and head node index of every link.
+    The labels and predecessor links of a single origin search are kept in preallocated lists reused across origins,
+    many origins can also be solved at once with scipy.sparse.csgraph.dijkstra (batch).
+    """
+
+    def __init__(self, numNodes: int, init_node: np.ndarray, term_node: np.ndarray):
+        self.numNodes = numNodes
+        self.init_node = np.ascontiguousarray(init_node, dtype=np.int64)
+        self.term_node = np.ascontiguousarray(term_node, dtype=np.int64)
+        self.numLinks = len(self.init_node)
+
+        # Forward star as python lists (node index -> [(link index, head node index), ...]),
+        # which is the fastest form for the heap based Dijkstra
+        self.link_tail = self.init_node.tolist()
+        self.adjacency = [[] for _ in range(numNodes)]
+        for link, (tail, head) in enumerate(zip(self.link_tail, self.term_node.tolist())):
+            self.adjacency[tail].append((link, head))
+
+        # Labels (node index -> label) and predecessor links (node index -> link index, -1 for none) of the last run,
+        # touched lists the nodes labelled by that run so that only those are reset by the next one
+        self.label = [np.inf] * numNodes
+        self.pred = [-1] * numNodes
+        self.touched = []
+
+        # (tail, head) key of every link, used to map the predecessor nodes returned by csgraph to links
+        self._pair_keys = self.init_node * numNodes + self.term_node
+
+    def run(self, origin: int, cost: list, targets=None):
+        """
+        Heap based Dijkstra from the origin (node index), the labels and preds are stored in self.label and self.pred.
+        If targets (node indices) are given the search stops as soon as all of them are settled,
+        the labels of the other nodes are then upper bounds only.
+        Links with an infinite cost are ignored.
+        """
+        label = self.label
+        pred = self.pred
+        adjacency = self.adjacency
+        for node in self.touched:
+            label[node] = np.inf
+            pred[node] = -1
+        touched = [origin]
+        self.touched = touched
+
+        pending = None
+        if targets is not None:
+            pending = set(targets)
+
+        label[origin] = 0.0
+        SE = [(0.0, origin)]
+        while SE:
+            currentLabel, currentNode = heapq.heappop(SE)
+            if currentLabel > label[currentNode]:
+                continue
+            if pending is not None:
+                pending.discard(currentNode)
+                if not pending:
+                    break
+            for link, newNode in adjacency[currentNode]:
+                newLabel = currentLabel + cost[link]
+                if newLabel < label[newNode]:
+                    if label[newNode] == np.inf:
+                        touched.append(newNode)
+                    heapq.heappush(SE, (newLabel, newNode))
+                    label[newNode] = newLabel
+                    pred[newNode] = link
+
+    def path(self, dest: int, pred: list = None) -> list:
+        """
+        Follows the predecessor links from dest back to the origin, returns the link indices from dest to origin.
+        Uses the preds of the last run unless a predecessor list (e.g. a row returned by batch) is given
+        """
+        if pred is None:
+            pred = self.pred
+        link_tail = self.link_tail
+        spLinks = []
+        prevLink = pred[dest]
+        while prevLink != -1:
+            spLinks.append(prevLink)
+            prevLink = pred[link_tail[prevLink]]
+        return spLinks
+
+    def node_path(self, dest: int, pred: list = None) -> list:
+        """
+        Returns the node indices of the shortest path from the origin to dest
+        """
+        spLinks = self.path(dest, pred)
+        nodes = [dest]
+        nodes.extend(self.link_tail[link] for link in spLinks)
+        nodes.reverse()
+        return nodes
+
+    def batch(self, origins, cost: np.ndarray):
+        """
+        Solves the shortest path problems of several origins in one scipy.sparse.csgraph.dijkstra call.
+        Parallel links are reduced to the cheapest one, links with an infinite cost are ignored.
+
+        :return: labels (origins x nodes) and predecessor links (origins x nodes, -1 for none)
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        cost = np.asarray(cost, dtype=np.float64)
+        usable = np.flatnonzero(np.isfinite(cost))
+        # cheapest link first within every (tail, head) pair
+        order = usable[np.lexsort((cost[usable], self._pair_keys[usable]))]
+        keys = self._pair_keys[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        links = order[first]
+        keys = keys[first]
+
+        # the csr matrix is built directly so that links with a zero cost are kept as explicit edges
+        indptr = np.zeros(self.numNodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.init_node[links], minlength=self.numNodes), out=indptr[1:])
+        graph = sp.csr_matrix((cost[links], self.term_node[links], indptr), shape=(self.numNodes, self.numNodes))
+
+        labels, predNodes = csgraph_dijkstra(graph, directed=True, indices=origins, return_predecessors=True)
+
+        preds = np.full(predNodes.shape, -1, dtype=np.int64)
+        reached = predNodes >= 0
+        pairKeys = predNodes[reached].astype(np.int64) * self.numNodes + np.nonzero(reached)[1]
+        preds[reached] = links[np.searchsorted(keys, pairKeys)]
+        return labels, preds
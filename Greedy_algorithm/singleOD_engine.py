@@ -0,0 +1,245 @@
+import os
+import time
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+
+from utils import ROUND, OD_pair, Route
+from dijkstra_routes import write_header, write_pair
+from od_flows import create_od_flows
+from path_assignment import PathFlows
+from warm_start import initial_od_flows, single_od_flows
+from assignment_singleOD import load_network, assignment_loop, writeResults, BPRcostFunction
+
+
+class SingleODResult:
+    def __init__(self, origin: str, destination: str, TSTT: float, pair, seconds: float,
+                 error: str = None, message: str = None, trace: str = None):
+        self.origin = origin
+        self.destination = destination
+        self.TSTT = TSTT  # total travel time of the OD pair (without the noise flow)
+        self.pair = pair  # OD_pair with the routes of the system optimum, fastest first, None if the pair failed
+        self.seconds = seconds
+        self.error = error  # name of the exception raised by a failed pair
+        self.message = message
+        self.trace = trace
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+_worker = {}
+
+
+def _init_worker(engine):
+    _worker["engine"] = engine
+
+
+def _solve_pair(task):
+    origin, destination, results_file, kwargs = task
+    return _worker["engine"].attempt((origin, destination), results_file=results_file, **kwargs)
+
+
+class SingleODEngine:
+    """
+    System optimum of every OD pair alone on top of the user equilibrium of all the other OD pairs (the noise flow),
+    computed in memory: the network is loaded and compiled once, the UE OD link flows are kept as a sparse matrix and
+    for every OD pair only the noise flow and the demand of the arrays are replaced before the assignment, which is
+    warm started from the UE flows of the pair.
+    """
+
+    def __init__(self,
+                 net_file: str,
+                 UE_OD_file: str = None,
+                 demand_file: str = None,
+                 costFunction=BPRcostFunction,
+                 ueAlgorithm: str = "B",
+                 ueAccuracy: float = 0.000005,
+                 verbose: bool = False):
+        """
+        :param UE_OD_file: OD pairs file of the user equilibrium (written by writeResults), when None the user
+               equilibrium is computed here with ueAlgorithm up to ueAccuracy
+        """
+        self.costFunction = costFunction
+        self.verbose = verbose
+        self.network = load_network(net_file=net_file, demand_file=demand_file, verbose=verbose)
+        arrays = self.network.compile()
+        self.tripSet = dict(self.network.tripSet)
+        self.odKeys = list(arrays.odKeys)
+        self.odIndex = dict(arrays.odIndex)
+        self.od_demand = arrays.od_demand.copy()
+
+        if UE_OD_file is None:
+            assignment_loop(self.network, algorithm=ueAlgorithm, systemOptimal=False, costFunction=costFunction,
+                            accuracy=ueAccuracy, maxIter=6000, maxTime=6000000, verbose=verbose)
+            self.ueODFlows = self.network.odFlows.flows.copy()
+        else:
+            odFlows = create_od_flows("link", arrays)
+            self.ueODFlows = odFlows.aon(initial_od_flows(arrays, UE_OD_file))
+        self.ueFlow = np.asarray(self.ueODFlows.sum(axis=0)).ravel()
+
+    def _select(self, od: int) -> np.ndarray:
+        """
+        Leaves only the demand of the OD pair in the network and sets the noise flow to the UE flow of the other pairs,
+        returns the UE link flows of the pair
+        """
+        network = self.network
+        arrays = network.arrays
+        start, end = self.ueODFlows.indptr[od], self.ueODFlows.indptr[od + 1]
+        links, flows = self.ueODFlows.indices[start:end], self.ueODFlows.data[start:end]
+        odFlow = np.zeros(arrays.numLinks)
+        odFlow[links] = flows
+
+        noise = np.maximum(self.ueFlow - odFlow, 0.0)
+        arrays.noise_flow[:] = noise
+        for link, noiseFlow in zip(network.linkSet.values(), noise.tolist()):
+            link.noise_flow = noiseFlow
+
+        odKey = self.odKeys[od]
+        network.tripSet = {odKey: self.tripSet[odKey]}
+        network.originZones = {odKey[0]}
+        arrays.set_demand([odKey], [self.od_demand[od]])
+        return odFlow
+
+    def solve(self,
+              odKey: tuple,
+              algorithm: str = "GP",
+              accuracy: float = 0.000001,
+              maxIter: int = 6000,
+              maxTime: int = 6000000,
+              minFlow: float = 0.0,
+              results_file: str = None) -> SingleODResult:
+        """
+        System optimum of a single OD pair (origin, destination) against the noise flow.
+        The route times and flows are rounded like the ones read from the OD pairs files (see dijkstra_routes.read_input).
+
+        :param results_file: if given the results of the pair are also written to this file (see writeResults)
+        """
+        startTime = time.time()
+        odKey = (str(odKey[0]), str(odKey[1]))
+        od = self.odIndex[odKey]
+        if self.od_demand[od] <= 0 or odKey[0] == odKey[1]:
+            return SingleODResult(odKey[0], odKey[1], 0.0, OD_pair(odKey[0], odKey[1], 0.0), time.time() - startTime)
+        odFlow = self._select(od)
+        TSTT = assignment_loop(self.network, algorithm=algorithm, systemOptimal=True, costFunction=self.costFunction,
+                               accuracy=accuracy, maxIter=maxIter, maxTime=maxTime, verbose=self.verbose,
+                               initialFlow=odFlow)
+
+        arrays = self.network.arrays
+        paths = self.network.paths
+        if paths is None:
+            paths = PathFlows(arrays, True, self.costFunction)
+            paths.load(single_od_flows(arrays, arrays.flow))
+        pair = paths.routes(minFlow)[0]
+        pair.set_routes([Route(round(route.time, ROUND), round(route.flow, ROUND), route.id, route.path)
+                         for route in pair.routes])
+
+        if results_file is not None:
+            writeResults(self.network, results_file, costFunction=self.costFunction, systemOptimal=True,
+                         verbose=False)
+        return SingleODResult(odKey[0], odKey[1], TSTT, pair, time.time() - startTime)
+
+    def attempt(self, odKey: tuple, **kwargs) -> SingleODResult:
+        """
+        Same as solve, an exception is returned as a failed SingleODResult instead of being raised
+        """
+        startTime = time.time()
+        try:
+            return self.solve(odKey, **kwargs)
+        except Exception as e:
+            return SingleODResult(str(odKey[0]), str(odKey[1]), None, None, time.time() - startTime,
+                                  error=type(e).__name__, message=str(e), trace=traceback.format_exc())
+
+    def _pending(self, odKeys: list, results_file: str, resume: bool) -> list:
+        if odKeys is None:
+            odKeys = [odKey for od, odKey in enumerate(self.odKeys)
+                      if self.od_demand[od] > 0 and odKey[0] != odKey[1]]
+        odKeys = [(str(origin), str(destination)) for origin, destination in odKeys]
+        # pairs without demand have nothing to solve, unknown pairs are kept to be reported as failures
+        odKeys = [odKey for odKey in odKeys
+                  if odKey not in self.odIndex or (odKey[0] != odKey[1] and self.od_demand[self.odIndex[odKey]] > 0)]
+        if resume and results_file is not None:
+            # the OD pairs file is the last one written by writeResults
+            odKeys = [(origin, destination) for origin, destination in odKeys
+                      if not os.path.isfile(results_file.format(origin=origin, destination=destination)
+                                            .replace(".txt", "_OD_pairs.txt"))]
+        return odKeys
+
+    def run(self, odKeys: list = None, results_file: str = None, resume: bool = False, **kwargs):
+        """
+        Solves the OD pairs one after the other (by default all the pairs with demand) and yields a SingleODResult
+        as soon as each of them is done, a pair whose assignment fails gives a failed result (see attempt).
+
+        :param results_file: file name pattern with {origin} and {destination} fields, to also write the results of
+               every pair to its own file
+        :param resume: skip the pairs whose results file already exists
+        :param kwargs: passed to solve
+        """
+        for origin, destination in self._pending(odKeys, results_file, resume):
+            yield self.attempt((origin, destination),
+                               results_file=None if results_file is None else
+                               results_file.format(origin=origin, destination=destination),
+                               **kwargs)
+
+    def run_parallel(self,
+                     results_file: str,
+                     routes_file: str = None,
+                     failures_file: str = None,
+                     odKeys: list = None,
+                     workers: int = None,
+                     resume: bool = True,
+                     **kwargs) -> list:
+        """
+        Solves the OD pairs on a pool of worker processes (all the cores by default). Every worker gets a copy of the
+        engine once (shared copy-on-write where processes are forked) and takes the next pair as soon as it is done
+        with the previous one. The pairs whose results file already exists are skipped, so an interrupted run can be
+        resumed.
+
+        :param results_file: file name pattern with {origin} and {destination} fields, the results of every pair are
+               written to its own file (see writeResults)
+        :param routes_file: consolidated routes of all the pairs solved by this run, appended as the pairs are done
+               (see dijkstra_routes.write_results)
+        :param failures_file: tab separated origin, destination, error and message of the failed pairs, appended
+        :param kwargs: passed to solve
+        :return: the failed results
+        """
+        odKeys = self._pending(odKeys, results_file, resume)
+        tasks = [(origin, destination, results_file.format(origin=origin, destination=destination), kwargs)
+                 for origin, destination in odKeys]
+        failures = []
+        routes = None
+        failuresOut = None
+        try:
+            if routes_file is not None:
+                newFile = not os.path.isfile(routes_file)
+                routes = open(routes_file, "a")
+                if newFile:
+                    write_header(routes)
+            if failures_file is not None:
+                newFile = not os.path.isfile(failures_file)
+                failuresOut = open(failures_file, "a")
+                if newFile:
+                    failuresOut.write("origin\tdestination\terror\tmessage\n")
+
+            with Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=(self,)) as pool:
+                for done, result in enumerate(pool.imap_unordered(_solve_pair, tasks, chunksize=1), start=1):
+                    if result.failed:
+                        failures.append(result)
+                        print(f"Error computing for {result.origin} - {result.destination}: {result.message}")
+                        if failuresOut is not None:
+                            message = " ".join(result.message.split())
+                            failuresOut.write(f"{result.origin}\t{result.destination}\t{result.error}\t{message}\n")
+                            failuresOut.flush()
+                    elif routes is not None:
+                        write_pair(routes, result.pair)
+                        routes.flush()
+                    if self.verbose:
+                        print(f"{done}/{len(tasks)} OD pairs done")
+        finally:
+            if routes is not None:
+                routes.close()
+            if failuresOut is not None:
+                failuresOut.close()
+        return failures
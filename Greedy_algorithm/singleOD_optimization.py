@@ -5,6 +5,8 @@ from dijkstra_routes import read_input
 from assignment_singleOD import computeAssignment, BPRcostFunction
 from dijkstra_routes import read_input, write_results, calculate_routes, unify_same_time_paths, average_paths
 from analytical import analytical_simulation
+from singleOD_engine import SingleODEngine
+from od_results import ODResults
 
 # workflow of the single OD optimization:
 # 1. Calculate the UE for the full network (assume its done in separate script)
@@ -13,56 +15,19 @@ from analytical import analytical_simulation
 #   b) Create a trips file for the selected OD pair
 #   c) Take the same network file as the one used for the UE assignment
 # 3. Calculate the SO for the OD pair using the assignment_singleOD.py script that uses the noise flow
+# Steps 2 and 3 run in memory for all the pairs with SingleODEngine, prepare_network writes the files of a single pair
 # 4. Plot the results of the assignment
 
-class CSVRecord:
-    def __init__(self, origin, destination, link_origin, link_destination, time, flow):
-        self.origin = origin
-        self.destination = destination
-        self.link_origin = link_origin  
-        self.link_destination = link_destination
-        self.time = time
-        self.flow = flow   
 
 def get_noise_flow(UE_OD_file, selected_OD):
     """
     Get the noise flow for the selected OD pair by removing the flow of the selected OD pair from the UE assignment.
-    :param UE_file: The file containing the UE assignment
+    :param UE_file: The file containing the UE assignment (*_OD_pairs.txt or *_OD_pairs.npz)
     :param selected_OD: The selected OD pair
     :return: The noise flow dataframe:
     Columns: [init_node, term_node, noise_flow]
     """
-    records = []
-    
-    with open(UE_OD_file, 'r') as file:
-        lines = file.readlines()
-        lines = lines[3:]
-        i = 0
-        while i < len(lines):
-            origin, destination, demand = lines[i].split()
-            demand = float(demand)
-            for j in range(i+1, len(lines)):
-                edge = lines[j]
-                if edge == '\n':
-                    i = j + 1
-                    break
-                # print(edge)
-                link_origin, link_destination, flow, time = edge.split()
-                flow = float(flow)
-                time = float(time)
-                records.append(CSVRecord(origin, destination, link_origin, link_destination, time, flow))
-                
-    # create a DataFrame from the records
-    df = pd.DataFrame([record.__dict__ for record in records])
-    # remove the flow of the selected OD pair - origin and destination is the same as in the UE assignment
-    df = df[~((df['origin'] == str(selected_OD[0])) & (df['destination'] == str(selected_OD[1])))]
-    # group by link_origin and link_destination and sum the flow
-    df = df.groupby(['link_origin', 'link_destination'])["flow"].sum().reset_index()
-    # cast init_node and term_node to int
-    df['link_origin'] = df['link_origin'].astype(int)
-    df['link_destination'] = df['link_destination'].astype(int)
-    return df.rename(columns={"link_origin": "init_node", "link_destination": "term_node", "flow": "noise_flow"})
-    # rename the columns
+    return ODResults.load(UE_OD_file).noise_flow(selected_OD)
 
 
 def prepare_network(net_file, UE_OD_file, selected_OD):
@@ -126,21 +91,17 @@ if __name__ == "__main__":
         pairs_UE = average_paths(pairs_UE)
         write_results(f'./assignments/{name}_result_UE_routes.txt', pairs_UE, 'UE')
 
-        for pairUE in pairs_UE:
-            net_file2, demand_file2 = prepare_network(net_file, f'./assignments/{name}_result_UE_OD_pairs.txt', (pairUE.origin, pairUE.destination))
-            try:
-                total_system_travel_time_equilibrium = computeAssignment(net_file=net_file2,
-                                                                        algorithm="FW",
-                                                                        costFunction=BPRcostFunction,
-                                                                        systemOptimal=True,
-                                                                        verbose=True,
-                                                                        accuracy=0.000001,
-                                                                        maxIter=6000,
-                                                                        maxTime=6000000, results_file=f'./assignments/sioux_pairs/{name}_{pairUE.origin}_{pairUE.destination}_result_UE.txt')
-                print("Computed for: ", name)
-            except Exception as e:
-                print(f"Error computing for {pairUE.origin} - {pairUE.destination}: {e}")
-                continue
+        # the network and the UE are loaded once, the SO of every pair is computed in memory (see singleOD_engine.py)
+        # on all the cores, the pairs already in sioux_pairs are skipped
+        engine = SingleODEngine(net_file, UE_OD_file=f'./assignments/{name}_result_UE_OD_pairs.txt')
+        failures = engine.run_parallel(results_file=f'./assignments/sioux_pairs/{name}_{{origin}}_{{destination}}_result_UE.txt',
+                                       routes_file=f'./assignments/{name}_result_singleOD_SO_routes.txt',
+                                       failures_file=f'./assignments/{name}_singleOD_failures.tsv',
+                                       odKeys=[(pairUE.origin, pairUE.destination) for pairUE in pairs_UE],
+                                       accuracy=0.000001,
+                                       maxIter=6000,
+                                       maxTime=6000000)
+        print("Computed for: ", name, len(failures), "OD pairs failed")
     else:
         # read the results from the files
         pairs_UE = []
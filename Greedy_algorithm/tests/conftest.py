@@ -0,0 +1,9 @@
+import os
+import sys
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+# the modules of Greedy_algorithm import each other by their plain names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+import os
+
+import networkx as nx
+import pytest
+
+from dijkstra_routes import read_input, calculate_routes
+
+ASSIGNMENTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assignments")
+
+
+def networkx_routes(pair) -> list:
+    """
+    Routes of an OD pair as they were found with nx.dijkstra_path on its flow graph
+    """
+    graph = nx.DiGraph()
+    for u, v, data in pair.graph.edges(data=True):
+        graph.add_edge(u, v, **data)
+    routes = []
+    while True:
+        try:
+            route = nx.dijkstra_path(graph, pair.origin, pair.destination, weight='time')
+        except nx.NetworkXNoPath:
+            break
+        edges = list(zip(route[:-1], route[1:]))
+        min_flow = min(graph[u][v]['flow'] for u, v in edges)
+        sum_time = 0
+        for u, v in edges:
+            graph[u][v]['flow'] -= min_flow
+            sum_time += graph[u][v]['time']
+        for u, v in edges:
+            if graph[u][v]['flow'] == 0:
+                graph.remove_edge(u, v)
+        if min_flow != 0:
+            routes.append((sum_time, min_flow, route))
+    return routes
+
+
+@pytest.mark.parametrize("name", ["SiouxFalls_result_UE", "Anaheim_result_UE", "Berlin_result_UE", "Berlin-Tiergarten_result_UE"])
+def test_routes_match_networkx(name):
+    pairs = []
+    read_input(os.path.join(ASSIGNMENTS, name + "_OD_pairs.txt"), pairs)
+    expected = {(pair.origin, pair.destination): networkx_routes(pair) for pair in pairs
+                if pair.origin != pair.destination and pair.origin in pair.graph and pair.destination in pair.graph}
+    calculate_routes(pairs)
+    for pair in pairs:
+        routes = [(route.time, route.flow, route.path) for route in pair.routes]
+        assert routes == expected.get((pair.origin, pair.destination), [])
@@ -0,0 +1,13 @@
+import pytest
+
+from greedy import run_simulation
+
+
+@pytest.mark.parametrize("history_mode", ["full", "periodic"])
+def test_run_simulation_without_steps(history_mode):
+    results = run_simulation(5, [(3, 10.0), (2, 7.5)], max_steps=0, history_mode=history_mode, stop_on_cycle=True)
+    assert results["steps"] == 0
+    assert results["mean"] == [] and results["variance"] == []
+    assert results["mean_final"] is None and results["variance_final"] is None
+    assert results["cycle"] is None
+    assert len(results["history"]) == 0
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+import matplotlib.pyplot as plt
+
+import assignment
+import assignment_singleOD
+
+NETWORK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tntp_networks", "Braess_net.tntp")
+
+
+@pytest.mark.parametrize("module", [assignment, assignment_singleOD])
+def test_write_results_graph(module, tmp_path, monkeypatch):
+    shown = []
+    monkeypatch.setattr(plt, "show", lambda: shown.append(True))
+    network = module.load_network(NETWORK, verbose=False)
+    module.assignment_loop(network, algorithm="FW", maxIter=5, verbose=False)
+    results_file = str(tmp_path / "Braess_result.txt")
+    module.writeResults(network, results_file, verbose=False, graph=True)
+    assert os.path.isfile(results_file)
+    assert len(shown) == len(network.tripSet)
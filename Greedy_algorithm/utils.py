@@ -1,6 +1,5 @@
 from typing import Tuple
 from pathlib import Path
-import networkx as nx
 import matplotlib.pyplot as plt
 import pandas as pd
 
@@ -45,7 +44,7 @@ class OD_pair:
         self.graph = {}
         self.routes = []
         
-    def add_graph(self, graph: nx.Graph):
+    def add_graph(self, graph):
         self.graph = graph
     
     def add_routes(self, routes: Route):
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+from network_import import read_link_flows
+from od_results import ODResults
+
+
+def _link_positions(arrays) -> dict:
+    return {arrays.link_key(link): link for link in range(arrays.numLinks)}
+
+
+def initial_link_flows(arrays, initialFlow) -> np.ndarray:
+    """
+    Link flows (in the link order of the arrays) of a warm start given as an array, a dictionary
+    (init_node, term_node) -> flow or the name of a result/flow file (see network_import.read_link_flows).
+    Links missing from the dictionary or the file get no flow.
+    """
+    if isinstance(initialFlow, (str, os.PathLike)):
+        initialFlow = read_link_flows(str(initialFlow))
+    if isinstance(initialFlow, dict):
+        positions = _link_positions(arrays)
+        flows = np.zeros(arrays.numLinks)
+        for (init_node, term_node), flow in initialFlow.items():
+            link = positions.get((str(init_node), str(term_node)))
+            if link is not None:
+                flows[link] = flow
+        return flows
+    flows = np.array(initialFlow, dtype=np.float64)
+    if flows.shape != (arrays.numLinks,):
+        raise ValueError(f"The initial flow must have one entry per link ({arrays.numLinks}), got shape {flows.shape}")
+    return flows
+
+
+def initial_od_flows(arrays, initialODFlows):
+    """
+    Link flows of the OD pairs of a warm start given as a dictionary (origin, destination) -> {(init_node, term_node): flow}
+    or the name of an OD pairs file (*_OD_pairs.txt or *_OD_pairs.npz, see od_results.ODResults), returned as
+    (od indices, link indices, flows). OD pairs or links unknown to the network are ignored.
+    """
+    if isinstance(initialODFlows, (str, os.PathLike)):
+        return _od_results_flows(arrays, ODResults.load(str(initialODFlows)))
+    positions = _link_positions(arrays)
+    ods, links, flows = [], [], []
+    for (origin, destination), odFlows in initialODFlows.items():
+        od = arrays.odIndex.get((str(origin), str(destination)))
+        if od is None:
+            continue
+        for (init_node, term_node), flow in odFlows.items():
+            link = positions.get((str(init_node), str(term_node)))
+            if link is not None and flow != 0:
+                ods.append(od)
+                links.append(link)
+                flows.append(flow)
+    return np.array(ods, dtype=np.int64), np.array(links, dtype=np.int64), np.array(flows, dtype=np.float64)
+
+
+def _od_results_flows(arrays, results) -> tuple:
+    positions = _link_positions(arrays)
+    odPosition = np.array([arrays.odIndex.get((str(o), str(d)), -1)
+                           for o, d in zip(results.origin.tolist(), results.destination.tolist())], dtype=np.int64)
+    linkPosition = np.array([positions.get((str(i), str(j)), -1)
+                             for i, j in zip(results.init_node.tolist(), results.term_node.tolist())], dtype=np.int64)
+    ods = odPosition[results.entry_od]
+    links = linkPosition[results.entry_link]
+    keep = (ods >= 0) & (links >= 0) & (results.entry_flow != 0)
+    return ods[keep], links[keep], results.entry_flow[keep]
+
+
+def default_od_flows_file(initialFlow):
+    """
+    The OD pairs file written next to a result file by writeResults, None if there is none
+    """
+    if not isinstance(initialFlow, (str, os.PathLike)):
+        return None
+    for suffix in ("_OD_pairs.npz", "_OD_pairs.txt"):
+        odFile = str(initialFlow).replace(".txt", suffix)
+        if odFile != str(initialFlow) and os.path.isfile(odFile):
+            return odFile
+    return None
+
+
+def single_od_flows(arrays, flows: np.ndarray):
+    """
+    When a single OD pair has demand its link flows are the link flows, returned as (od indices, link indices, flows),
+    None otherwise
+    """
+    loaded = np.flatnonzero(arrays.od_demand > 0)
+    if len(loaded) != 1:
+        return None
+    links = np.flatnonzero(flows)
+    return np.full(len(links), loaded[0], dtype=np.int64), links.astype(np.int64), flows[links]
@@ -1,12 +1,15 @@
 from assignment import computeAssignment, BPRcostFunction
 from utils import PathUtils, num_of_routes
 from dijkstra_routes import read_input, write_results, calculate_routes, unify_same_time_paths, average_paths
-from greedy import run_simulation, prep_data
+from greedy import prep_pairs, run_simulations
+from parallel_od import simulate_pairs
 import pandas as pd
 
 
 _compute_assignments = False
 _compute_CSO = False
+_batch_simulation = True
+_workers = None # process pool size when the OD pairs are simulated one by one, all the cores by default
 
 if __name__ == "__main__":
     net_file = str(PathUtils.anaheim_net_file)
@@ -73,62 +76,47 @@ if __name__ == "__main__":
     diff = 0
     len_simul = 200
     results = {}
-    for pairSO, pairUE, in zip(pairs_SO, pairs_UE):
-        if pairSO.origin != pairUE.origin or pairSO.destination != pairUE.destination:
-            print("Error: OD pairs do not match")
-            break
-        if num_of_routes(pairSO.routes) < 2:
-            # print("Not enough routes for ", pairSO.origin, pairSO.destination)
-            continue
-        if pairSO.origin == 34 and pairSO.destination == 15:
-            print("Special case for pair: ", pairSO.origin, pairSO.destination)
-            print("Routes: ", pairSO.routes)
-            for r in pairSO.routes:
-                print("Route: ", r.time, r.flow, r.id)
-            exit(0)
-        routes = pairSO.routes
-        agents = pairSO.flow
-        print("Running simulation for ", pairSO.origin, pairSO.destination)
-        agents, routes = prep_data(routes)
-        thresholds = [0.33, 0.2, 0.1]
-        # print("Agents: ", agents)
-        # print("Routes: ", routes)
-        # return np.finfo(np.float32).max
-        results = run_simulation(agents, routes, thresholds,len_simul, 0.0)
-        history = results['history']
-        mean = results['mean']
-        variance = results['variance']
-        convergence = results['convergence']
-        if not convergence[0]:
-            print("Did not converge for ", pairSO.origin, pairSO.destination)
-        else:
-            print("Converged in ", convergence[1], " steps")
-        print("Difference for individual between UE and SO: ", pairUE.routes[0].time - mean[-1]/len_simul, pairUE.routes[0].time)
-        diff = diff + pairUE.routes[0].time - mean[-1]/len_simul
-        print("Mean: ", mean)
-        print("Variance: ", variance)
-        print("History: ", history)
-        print("Agents: ", agents)
-        print("Fairness: ", results['fairness'])
-        print("Almost convergence: ", results['almost_convergence'])
-        print("Fairness normalized: ", results['fairness_norm'])  
-        res = {
-            "origin": pairSO.origin,
-            "destination": pairSO.destination,
-            "mean": mean[-1]/len_simul,
-            "variance": variance[-1],
-            "convergence": convergence[0],
-            "convergence_iter": convergence[1],
-            "history": history,
-            "agents": agents,
-            "fairness": results['fairness'],
-            "almost_convergence": results['almost_convergence'],
-            "fairness_norm": results['fairness_norm'],
-        }
-        results[pairSO.origin, pairSO.destination] = res # type: ignore
+    if _batch_simulation:
+        # all the OD pairs with at least 2 routes in one vectorized simulation
+        ue_time = {(pairUE.origin, pairUE.destination): pairUE.routes[0].time for pairUE in pairs_UE if pairUE.routes}
+        keys, route_ptr, route_flow, route_time = prep_pairs([pairSO for pairSO in pairs_SO
+                                                              if num_of_routes(pairSO.routes) >= 2])
+        df = run_simulations(route_ptr, route_flow, route_time, [0.33, 0.2, 0.1], len_simul, 0.0, keys=keys)
+        df["mean"] = df["mean"] / len_simul
+        df["UE_time"] = [ue_time[key] for key in keys]
+        diff = (df["UE_time"] - df["mean"]).sum()
+        print("Did not converge for ", (~df["converged"]).sum(), " of ", len(df), " OD pairs")
+    else:
+        # every OD pair with at least 2 routes on its own core, the results are kept in a file to resume from
+        ue_time = {(pairUE.origin, pairUE.destination): pairUE.routes[0].time for pairUE in pairs_UE if pairUE.routes}
+        pairs = [pairSO for pairSO in pairs_SO if num_of_routes(pairSO.routes) >= 2]
+        simulations = simulate_pairs(pairs, results_file=f'./assignments/{name}_greedy_results.jsonl',
+                                     workers=_workers, thresholds=[0.33, 0.2, 0.1], max_steps=len_simul, eps=0.0,
+                                     history_mode="none", stop_on_cycle=True)
+        for res in simulations:
+            if res["agents"] == 0:
+                continue
+            key = (res["origin"], res["destination"])
+            if not res["convergence"][0]:
+                print("Did not converge for ", *key)
+            diff = diff + ue_time[key] - res['mean_final']/len_simul
+            results[key] = {
+                "origin": res["origin"],
+                "destination": res["destination"],
+                "mean": res['mean_final']/len_simul,
+                "variance": res['variance_final'],
+                "convergence": res["convergence"][0],
+                "convergence_iter": res["convergence"][1],
+                "agents": res["agents"],
+                "fairness": res['fairness'],
+                "almost_convergence": res['almost_convergence'],
+                "fairness_norm": res['fairness_norm'],
+                "cycle": res['cycle'],
+            }
     # save results to file
     
-    df = pd.DataFrame.from_dict(results, orient='index')
+    if not _batch_simulation:
+        df = pd.DataFrame.from_dict(results, orient='index')
 
     print("Total difference: ", diff)
     if diff < 0: